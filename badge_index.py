@@ -0,0 +1,66 @@
+# Reverse indexes over the badge table: from badge ID to the advertising
+# addresses that have sent it, and from name to addresses.
+#
+# BadgeDisplay only notices a faked ID when one address sends more than one
+# ID. These catch the other way round, a badge cloning someone else's ID
+# from a different address, in constant time per intercept. Two badge
+# types can use the same ID, so that alone isn't a clone.
+
+# Sent by every device that isn't a badge type we know, so not an identity
+UNKNOWN_ID = "????"
+
+
+class BadgeIndex:
+    """ IDs are only unique within a badge type, so the ID index is keyed
+    on (badge type, ID). Entries are only for badges in memory: remove()
+    a badge when the store evicts it, or the index grows without end."""
+
+    def __init__(self):
+        self.by_id = {}      # (badge type, badge ID) -> set of addresses
+        self.by_name = {}    # name -> set of addresses
+
+    def add(self, addr, badge_type, ident, name):
+        """ Record one intercept. Returns True if this makes ident a clone,
+        that is, the first time a second address has sent it."""
+        self.by_name.setdefault(name, set()).add(addr)
+        if ident == UNKNOWN_ID:
+            return False
+        addrs = self.by_id.setdefault((badge_type, ident), set())
+        if addr in addrs:
+            return False
+        addrs.add(addr)
+        return len(addrs) == 2
+
+    def remove(self, addr, badge_type, idents, names):
+        """ Forget an address, given every ID and name it has sent. """
+        for ident in idents:
+            self.discard(self.by_id, (badge_type, ident), addr)
+        for name in names:
+            self.discard(self.by_name, name, addr)
+
+    @staticmethod
+    def discard(index, key, addr):
+        addrs = index.get(key)
+        if addrs is not None:
+            addrs.discard(addr)
+            if not addrs:
+                del index[key]
+
+    def is_cloned(self, badge_type, ident):
+        addrs = self.by_id.get((badge_type, ident))
+        return addrs is not None and len(addrs) > 1
+
+    def addresses_for_id(self, badge_type, ident):
+        return frozenset(self.by_id.get((badge_type, ident), ()))
+
+    def addresses_for_name(self, name):
+        return frozenset(self.by_name.get(name, ()))
+
+    def clones(self):
+        """ Badge IDs sent from more than one address, with the addresses,
+        keyed on (badge type, ID). """
+        return {key: frozenset(addrs) for key, addrs in self.by_id.items() if len(addrs) > 1}
+
+    def name_collisions(self):
+        """ Names sent from more than one address, with the addresses. """
+        return {name: frozenset(addrs) for name, addrs in self.by_name.items() if len(addrs) > 1}
@@ -0,0 +1,253 @@
+# Parsing of badge advertisements out of raw HCI event frames.
+#
+# Shared by the Wall and the tools that work on its logs, so nothing
+# in here needs Tk or a Bluetooth adapter.
+
+from collections import OrderedDict
+import wall_metrics
+
+BADGE_TYPE_TRANSIO = 0x064a
+BADGE_TYPE_TRANSIO_TMP = 0x0858
+BADGE_TYPE_JOCO = 0x0b25
+BADGE_TYPE_ANDNXOR = 0x049e
+
+BADGE_YEAR = "yr"     # year (Appearance field) in most recent advertisement
+BADGE_YEARS = "yrs"   # list of years seen for this address
+BADGE_NAME = "nm"     # badge name (Complete Local Name) in most recent
+BADGE_NAMES = "nms"   # list of names seen for this address
+BADGE_ID = "id"       # badge ID (first two octets of Manufacturer Specific Data)
+BADGE_IDS = "ids"     # list of badge IDs seen for this address
+BADGE_TIME = "tm"     # time of most recent advertisement received
+BADGE_MONO = "mono"   # same, on the monotonic clock, for working out ages
+BADGE_ADDR = "ad"     # Advertising Address for this badge (assumed constant)
+BADGE_CNT = "n"       # number of advertisements received from this address
+BADGE_ID_FAKED = "faked"    # present if multiple IDs seen for this address
+BADGE_CTRINKET = "tkt"    # claimed to deserve a trinket
+BADGE_CSCORE = "csc"  # claimed current score
+BADGE_TYPE = "ty"     # Badge type (Company ID)
+BADGE_RSSI = "rssi"   # signal strength of most recent advertisement, dBm
+
+# HCI LE Meta Event subevents carrying advertising reports
+EVT_LE_ADVERTISING_REPORT = 0x02
+EVT_LE_EXT_ADVERTISING_REPORT = 0x0D
+
+parse_cache_size = 512   # distinct advertisements remembered by ParseCache
+
+metrics = wall_metrics.registry
+parse_failures = {reason: metrics.counter("wall_parse_failures_total",
+                                          "frames that were not a usable badge advertisement",
+                                          {"reason": reason})
+                  for reason in ("not_badge", "no_name", "no_year", "malformed")}
+
+
+def signed8(x):
+    return x - 256 if x > 127 else x
+
+
+def advertisingReports(data):
+    """ Yield (address, ad_data, rssi) for each report in an HCI LE
+    Advertising Report or LE Extended Advertising Report event.
+
+    The controller may pack several reports into one event. address and
+    ad_data are memoryviews into data, not copies; address is in the
+    over-the-air (little-endian) byte order."""
+
+    if len(data) < 5:
+        return
+    view = memoryview(data)
+    subevent = data[3]
+    num_reports = data[4]
+    index = 5
+    if subevent == EVT_LE_ADVERTISING_REPORT:
+        # event type, address type, address[6], data length, data, rssi
+        for i in range(num_reports):
+            if index + 9 > len(data):
+                break
+            length = data[index+8]
+            end = index + 9 + length
+            if end >= len(data):
+                parse_failures["malformed"].inc()
+                break
+            yield view[index+2:index+8], view[index+9:end], signed8(data[end])
+            index = end + 1
+    elif subevent == EVT_LE_EXT_ADVERTISING_REPORT:
+        # event type[2], address type, address[6], primary phy,
+        # secondary phy, sid, tx power, rssi, interval[2],
+        # direct address type, direct address[6], data length, data
+        for i in range(num_reports):
+            if index + 24 > len(data):
+                break
+            length = data[index+23]
+            end = index + 24 + length
+            if end > len(data):
+                parse_failures["malformed"].inc()
+                break
+            # Only complete data; badges don't send fragmented advertisements
+            if (data[index] >> 5) & 0x03 == 0:
+                yield view[index+3:index+9], view[index+24:end], signed8(data[index+13])
+            index = end
+
+
+def reportParse(address, ad_data):
+    """ If the advertising data in one report contains a valid badge
+    beacon, return the parsed badge data structure. If not, return None."""
+
+    badge_address = ':'.join('{0:02x}'.format(x) for x in reversed(address))
+
+    index = 0
+    badge = False
+    badge_name = None
+    badge_year = None
+    dc26 = False
+    while (index < len(ad_data)):
+        packet_len = ad_data[index]
+        if packet_len == 0:     # early end of the significant part
+            break
+        packet_type = ad_data[index+1]
+        packet_payload = ad_data[index+2:index+2+packet_len-1]
+        index += packet_len+1
+        if packet_type == 0x01:     # Flags
+            if int(packet_payload[0]) != 0x06:
+                badge = False
+        elif packet_type == 0x09:   # Local Name
+            badge_name = str(packet_payload, "utf-8")
+            badge_name = badge_name[0:8]
+        elif packet_type == 0x19:   # Appearance
+            badge_year = "%02X%d" % (packet_payload[0], packet_payload[1])
+            if packet_payload[1] == 0x26:
+                dc26 = True
+            elif packet_payload[1] == 0x19:
+                dc26 = False
+            else:
+                badge_year = None
+        elif packet_type == 0xFF:   # Manufacturer Specific Data
+            badge_type = (packet_payload[1] << 8) + packet_payload[0]
+            if badge_type == BADGE_TYPE_JOCO or badge_type == BADGE_TYPE_TRANSIO_TMP:
+                badge_id = "%02X%02X" % (packet_payload[3], packet_payload[2])
+                badge_claimed_score = (packet_payload[4] << 8) + packet_payload[5]
+                badge_claimed_trinket = badge_claimed_score & 0x8000
+                badge_claimed_score = badge_claimed_score & 0x7FFF
+                badge = True
+            elif badge_type == BADGE_TYPE_TRANSIO:
+                badge_id = "%02X%02X" % (packet_payload[4], packet_payload[3])
+                badge_claimed_trinket = 0
+                badge_claimed_score = (packet_payload[6] << 8) + packet_payload[7]
+                badge = True
+            elif badge_type == BADGE_TYPE_ANDNXOR:
+                if dc26:
+                    badge_id_offset = 3
+                else:
+                    badge_id_offset = 2
+                badge_id = "%02X%02X" % (packet_payload[badge_id_offset+1], packet_payload[badge_id_offset])
+                badge_claimed_trinket = 0
+                badge_claimed_score = -1   # so it always sorts below JoCo badges
+                badge = True
+            else:
+                badge_id = "????"
+                badge_claimed_trinket = 0
+                badge_claimed_score = -2
+                badge_year = "DCxx"
+                badge = True
+
+    if badge and badge_name is not None and badge_year is not None:
+        return {BADGE_ADDR:   badge_address,
+                BADGE_ID:     badge_id,
+                BADGE_NAME:   badge_name,
+                BADGE_YEAR:   badge_year,
+                BADGE_CTRINKET:   badge_claimed_trinket,
+                BADGE_CSCORE: badge_claimed_score,
+                BADGE_TYPE:   badge_type}
+    else:
+        if not badge:
+            parse_failures["not_badge"].inc()
+        elif badge_name is None:
+            parse_failures["no_name"].inc()
+        else:
+            parse_failures["no_year"].inc()
+        return None
+
+
+def badgeParse(data):
+    """ Return a list of the parsed badge data structures for every
+    report in the event that contains a valid badge beacon, each with
+    the report's RSSI. The list is empty if there are none."""
+
+    badges = []
+    for address, ad_data, rssi in advertisingReports(data):
+        try:
+            badge = reportParse(address, ad_data)
+        except (IndexError, UnicodeDecodeError):
+            parse_failures["malformed"].inc()
+            continue
+        if badge is not None:
+            badge[BADGE_RSSI] = rssi
+            badges.append(badge)
+    return badges
+
+
+class ParseCache:
+    """ Badges repeat the same advertisement over and over until their
+    score or name changes, so remember the parse of each distinct
+    advertisement and skip badgeParse for the repeats.
+
+    Each report in an event is looked up separately, keyed on its
+    advertising address and AD structures, leaving out the RSSI, which
+    changes from one copy to the next. Least recently seen
+    advertisements are dropped once there are more than size of them.
+    Frames that aren't badges are remembered too, so their parse failures
+    are only counted the first time."""
+
+    def __init__(self, size=parse_cache_size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def parse(self, data):
+        """ Same as badgeParse(data), but uses fresh copies of cached
+        results for advertisements seen before. Callers own the dicts
+        they get back and may modify them."""
+
+        if not isinstance(data, bytes):
+            # Views of a writable buffer can't be hashed, and the keys
+            # mustn't change if it's reused
+            data = bytes(data)
+        badges = []
+        for address, ad_data, rssi in advertisingReports(data):
+            # Views of bytes hash and compare equal to the bytes keys,
+            # so a hit doesn't copy anything out of the frame.
+            key = (address, ad_data)
+            try:
+                badge = self.entries[key]
+                self.entries.move_to_end(key)
+                self.hits += 1
+            except KeyError:
+                try:
+                    badge = reportParse(address, ad_data)
+                except (IndexError, UnicodeDecodeError):
+                    parse_failures["malformed"].inc()
+                    continue
+                self.misses += 1
+                self.entries[(bytes(address), bytes(ad_data))] = badge
+                if len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+            if badge is not None:
+                badge = dict(badge)
+                badge[BADGE_RSSI] = rssi
+                badges.append(badge)
+        return badges
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return self.hits / lookups
+
+    def stats(self):
+        return {"entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hit_rate()}
@@ -0,0 +1,195 @@
+# The Wall's table of badges, keyed by advertising address, with a cap
+# on how many are kept in memory.
+#
+# Phones and trackers with rotating random addresses would otherwise pile
+# up entries for days. Badges not heard from for a while, or ranked
+# lowest once the table is full, are moved out to a cold store on disk.
+# If one is heard again it's brought back with its counts, names and
+# flags as they were.
+
+import sys
+import time
+import shelve
+
+import wall_metrics
+from badge_parse import (
+    BADGE_ADDR,
+    BADGE_CNT,
+    BADGE_CSCORE,
+    BADGE_CTRINKET,
+    BADGE_ID,
+    BADGE_IDS,
+    BADGE_ID_FAKED,
+    BADGE_MONO,
+    BADGE_NAME,
+    BADGE_NAMES,
+    BADGE_RSSI,
+    BADGE_TIME,
+    BADGE_YEAR,
+    BADGE_YEARS,
+)
+
+badge_memory_cap = 1000         # most badges kept in memory
+badge_max_age = 2 * 60 * 60     # seconds since last heard before going cold
+cold_store_file = "badges.cold"
+evict_slack = 0.1               # evict this much extra, so we don't sort every insert
+
+metrics = wall_metrics.registry
+m_evicted = {reason: metrics.counter("wall_badges_evicted_total", "badges moved to the cold store",
+                                     {"reason": reason})
+             for reason in ("age", "rank")}
+m_restored = metrics.counter("wall_badges_restored_total", "badges brought back from the cold store")
+
+
+# Fields that always hold the value from the most recent intercept
+LATEST_FIELDS = (BADGE_NAME, BADGE_ID, BADGE_TIME, BADGE_MONO, BADGE_YEAR,
+                 BADGE_CTRINKET, BADGE_CSCORE, BADGE_RSSI)
+
+
+def merge_intercept(badges, badge):
+    """ Fold one parsed intercept into a badge table, a dict or a
+    BadgeStore keyed by address. The first intercept from an address
+    becomes its entry; later ones update it. """
+
+    if badge[BADGE_ADDR] not in badges:
+        badge[BADGE_IDS] = [badge[BADGE_ID]]
+        badge[BADGE_NAMES] = [badge[BADGE_NAME]]
+        badge[BADGE_YEARS] = [badge[BADGE_YEAR]]
+        badge[BADGE_CNT] = 1
+        badges[badge[BADGE_ADDR]] = badge
+
+    else:
+        b = badges[badge[BADGE_ADDR]]
+        b[BADGE_CNT] += 1
+        b[BADGE_NAME] = badge[BADGE_NAME]
+        b[BADGE_ID] = badge[BADGE_ID]
+        b[BADGE_TIME] = badge[BADGE_TIME]
+        b[BADGE_MONO] = badge[BADGE_MONO]
+        b[BADGE_YEAR] = badge[BADGE_YEAR]
+        if badge[BADGE_NAME] not in b[BADGE_NAMES]:
+            b[BADGE_NAMES].append(badge[BADGE_NAME])
+        if badge[BADGE_ID] not in b[BADGE_IDS]:
+            b[BADGE_IDS].append(badge[BADGE_ID])
+        if badge[BADGE_YEAR] not in b[BADGE_YEARS]:
+            b[BADGE_YEARS].append(badge[BADGE_YEAR])
+        if len(b[BADGE_IDS]) > 1:
+            b[BADGE_ID_FAKED] = True
+        b[BADGE_CTRINKET] = badge[BADGE_CTRINKET]
+        b[BADGE_CSCORE] = badge[BADGE_CSCORE]
+        b[BADGE_RSSI] = badge[BADGE_RSSI]
+
+
+def merge_entries(earlier, later):
+    """ Combine two entries for the same address, each built by
+    merge_intercept from consecutive runs of intercepts, into the entry
+    merge_intercept would have built from the whole run. Modifies and
+    returns earlier. """
+
+    earlier[BADGE_CNT] += later[BADGE_CNT]
+    for field in LATEST_FIELDS:
+        earlier[field] = later[field]
+    for field in (BADGE_NAMES, BADGE_IDS, BADGE_YEARS):
+        earlier[field].extend(x for x in later[field] if x not in earlier[field])
+    if len(earlier[BADGE_IDS]) > 1:
+        earlier[BADGE_ID_FAKED] = True
+    return earlier
+
+
+def badge_size(badge):
+    """ Rough memory used by one badge entry, in bytes. """
+    size = sys.getsizeof(badge)
+    for key, value in badge.items():
+        size += sys.getsizeof(key) + sys.getsizeof(value)
+        if isinstance(value, list):
+            size += sum(sys.getsizeof(x) for x in value)
+    return size
+
+
+class BadgeStore:
+    """ Dict-like, for what BadgeDisplay needs: in, [], []=, values() and len().
+    values() and len() only cover the badges in memory, which are the
+    ones on the board. Looking up a cold badge brings it back into memory."""
+
+    def __init__(self, cap=badge_memory_cap, max_age=badge_max_age,
+                 filename=cold_store_file, clock=time.monotonic, on_evict=None):
+        """ on_evict(badge), if given, is called for each badge moved to
+        the cold store. """
+        self.cap = cap
+        self.on_evict = on_evict
+        self.max_age = max_age
+        self.clock = clock
+        self.hot = {}
+        # Monotonic times don't mean anything in another run, so start fresh
+        self.cold = shelve.open(filename, flag="n")
+        self.cold_count = 0
+        self.cold_dirty = False     # changed since the last sync
+        # Measured by evict(), on the thread using the store: the metrics
+        # server can't walk the badges while they're being updated
+        self.hot_bytes = 0
+        metrics.gauge("wall_badges_hot", "badges in memory", func=lambda: len(self.hot))
+        metrics.gauge("wall_badges_cold", "badges in the cold store", func=lambda: self.cold_count)
+        metrics.gauge("wall_badges_hot_bytes", "approximate memory used by badges in memory",
+                      func=lambda: self.hot_bytes)
+
+    def __contains__(self, addr):
+        return addr in self.hot or addr in self.cold
+
+    def __getitem__(self, addr):
+        try:
+            return self.hot[addr]
+        except KeyError:
+            badge = self.cold.pop(addr)
+            self.cold_count -= 1
+            self.cold_dirty = True
+            m_restored.inc()
+            self[addr] = badge
+            return badge
+
+    def __setitem__(self, addr, badge):
+        # Make room first, so the badge being added is never the one evicted
+        if addr not in self.hot and len(self.hot) >= self.cap:
+            self.evict(room=1)
+        self.hot[addr] = badge
+
+    def __len__(self):
+        return len(self.hot)
+
+    def values(self):
+        return self.hot.values()
+
+    def spill(self, addr, reason):
+        badge = self.hot.pop(addr)
+        self.cold[addr] = badge
+        if self.on_evict is not None:
+            self.on_evict(badge)
+        self.cold_count += 1
+        self.cold_dirty = True
+        m_evicted[reason].inc()
+
+    def evict(self, now=None, room=0):
+        """ Move stale badges, then the lowest ranked ones if there are
+        still too many, out to the cold store. Call now and then, as well
+        as when the table fills up."""
+
+        if now is None:
+            now = self.clock()
+        for addr in [a for a, b in self.hot.items() if now - b[BADGE_MONO] > self.max_age]:
+            self.spill(addr, "age")
+        if len(self.hot) + room > self.cap:
+            excess = len(self.hot) + room - int(self.cap * (1 - evict_slack))
+            ranked = sorted(self.hot.values(), key=lambda b: (b[BADGE_CSCORE], b[BADGE_MONO]))
+            for badge in ranked[:excess]:
+                self.spill(badge[BADGE_ADDR], "rank")
+        if self.cold_dirty:
+            # Disk I/O on the display thread, so only when there's something to write
+            self.cold.sync()
+            self.cold_dirty = False
+        self.hot_bytes = self.memory_usage()
+
+    def memory_usage(self):
+        """ Only call on the thread using the store. """
+        return sys.getsizeof(self.hot) + sum(badge_size(b) for b in self.hot.values())
+
+    def close(self):
+        self.cold.close()
+
@@ -0,0 +1,65 @@
+# How a badge is shown on the Wall's board, for the board itself and for
+# the tools that print or benchmark one without a display. Nothing here
+# needs Tk.
+
+from badge_parse import (
+    BADGE_TYPE_TRANSIO,
+    BADGE_TYPE_TRANSIO_TMP,
+    BADGE_TYPE_JOCO,
+    BADGE_TYPE,
+    BADGE_ID,
+    BADGE_NAME,
+    BADGE_MONO,
+    BADGE_ID_FAKED,
+    BADGE_CTRINKET,
+    BADGE_CSCORE,
+)
+
+
+def board_flag(b, disputed=False, cloned=False):
+    """ The character shown before a badge's ID. disputed is whether an
+    audit found its claimed score isn't backed up, cloned whether another
+    address has sent its ID. """
+    typ = b[BADGE_TYPE]
+    if typ == BADGE_TYPE_JOCO or typ == BADGE_TYPE_TRANSIO_TMP or typ == BADGE_TYPE_TRANSIO:
+        if disputed:
+            return "?"      # GATT score doesn't back up the claimed score
+        if b[BADGE_CTRINKET] != 0:
+            return "!"      # claims to be eligible for a trinket
+    if BADGE_ID_FAKED in b:
+        return "*"          # this address has sent more than one ID
+    if cloned:
+        return "#"          # another address has sent this ID
+    return " "
+
+
+def format_time_ago(t, timenow):
+    age = timenow - t
+    if age < 5.0:
+        return " just now"
+    else:
+        hours = int(age / (60*60))
+        age -= hours * 60*60
+        minutes = int(age / 60)
+        age -= minutes * 60
+        secs = int(age/5) * 5
+        if hours > 0:
+            return "%3d:%02d:%02d" % (hours, minutes, secs)
+        else:
+            return "    %2d:%02d" % (minutes, secs)
+
+
+def board_line(b, flag, timenow):
+    """ One badge's line on the board, given its flag and the monotonic
+    time now. """
+    name = b[BADGE_NAME]
+    typ = b[BADGE_TYPE]
+    if typ == BADGE_TYPE_JOCO or typ == BADGE_TYPE_TRANSIO_TMP or typ == BADGE_TYPE_TRANSIO:
+        if b[BADGE_CSCORE] >= 1000:
+            score = "%2d,%03d" % (b[BADGE_CSCORE]/1000, b[BADGE_CSCORE] % 1000)
+        else:
+            score = " %5d" % b[BADGE_CSCORE]
+    else:
+        score = "   N/A"
+    t = format_time_ago(b[BADGE_MONO], timenow)
+    return flag + " " + b[BADGE_ID] + " " + name + " "*(8-len(name)) + " " + score + " " + t
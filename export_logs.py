@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# Convert the Wall's intercept logs into columnar NumPy datasets for
+# post-event analysis, parsing them in parallel on all cores.
+#
+#   ./export_logs.py logs/ --out dataset/
+#   ./export_logs.py logs/ --out dataset/ --watch 60
+#
+# Each log file becomes one dataset/<logname>.npz, so running it again
+# (or leaving it running with --watch) only converts log files that are
+# new or have changed. Each .npz has one array per column:
+#
+#   frame_time      float64   receive time of each raw frame
+#   frame_length    uint16    length of each raw frame
+#   frame_data      uint8     raw frames, one per row, zero padded
+#   time            float64   per parsed badge report from here down
+#   frame           int32     row of the frame it came from
+#   addr            U17       advertising address
+#   id              U4        badge ID
+#   name            U8
+#   year            U4
+#   type            uint16    badge type (company ID)
+#   score           int32     claimed score
+#   trinket         int32     claimed trinket flag
+#   rssi            int8
+#
+# load() reads a whole dataset directory back as one set of columns.
+#
+# Needs numpy (sudo apt-get install python3-numpy).
+
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import wall_logs
+from badge_parse import (
+    badgeParse,
+    BADGE_ADDR,
+    BADGE_ID,
+    BADGE_NAME,
+    BADGE_YEAR,
+    BADGE_TYPE,
+    BADGE_CSCORE,
+    BADGE_CTRINKET,
+    BADGE_RSSI,
+)
+
+report_columns = (
+    ("time", "f8"),
+    ("frame", "i4"),
+    ("addr", "U17"),
+    ("id", "U4"),
+    ("name", "U8"),
+    ("year", "U4"),
+    ("type", "u2"),
+    ("score", "i4"),
+    ("trinket", "i4"),
+    ("rssi", "i1"),
+)
+report_dtype = np.dtype(list(report_columns))
+
+
+def part_name(outdir, logfile):
+    return os.path.join(outdir, os.path.splitext(os.path.basename(logfile))[0] + ".npz")
+
+
+def convert(logfile, outdir):
+    """ Parse one log file and write its .npz. Returns (logfile, frames, reports). """
+    frames = list(wall_logs.read_log(logfile))
+    reports = []
+    for n, (ts, data) in enumerate(frames):
+        for badge in badgeParse(data):
+            reports.append((ts, n,
+                            badge[BADGE_ADDR], badge[BADGE_ID], badge[BADGE_NAME],
+                            badge[BADGE_YEAR], badge[BADGE_TYPE], badge[BADGE_CSCORE],
+                            badge[BADGE_CTRINKET], badge[BADGE_RSSI]))
+
+    width = max((len(data) for ts, data in frames), default=0)
+    frame_data = np.zeros((len(frames), width), dtype="u1")
+    for n, (ts, data) in enumerate(frames):
+        frame_data[n, :len(data)] = np.frombuffer(data, dtype="u1")
+    table = np.array(reports, dtype=report_dtype)
+
+    columns = {name: table[name] for name, kind in report_columns}
+    columns["frame_time"] = np.array([ts for ts, data in frames], dtype="f8")
+    columns["frame_length"] = np.array([len(data) for ts, data in frames], dtype="u2")
+    columns["frame_data"] = frame_data
+
+    part = part_name(outdir, logfile)
+    temp = part + ".tmp.npz"
+    np.savez_compressed(temp, **columns)
+    os.replace(temp, part)
+    return (logfile, len(frames), len(reports))
+
+
+def pending(logfiles, outdir):
+    """ Log files with no .npz yet, or changed since theirs was written. """
+    todo = []
+    for logfile in logfiles:
+        part = part_name(outdir, logfile)
+        try:
+            if os.path.getmtime(part) >= os.path.getmtime(logfile):
+                continue
+        except OSError:
+            pass
+        todo.append(logfile)
+    return todo
+
+
+def export(paths, outdir, jobs=None):
+    os.makedirs(outdir, exist_ok=True)
+    todo = pending(wall_logs.log_files(paths), outdir)
+    if not todo:
+        return 0
+    start = time.perf_counter()
+    frames = reports = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for logfile, nframes, nreports in pool.map(convert, todo, [outdir] * len(todo),
+                                                   chunksize=max(1, len(todo) // 64)):
+            frames += nframes
+            reports += nreports
+    elapsed = time.perf_counter() - start
+    print("Converted %d log files, %d frames, %d badge reports in %.1fs" %
+          (len(todo), frames, reports, elapsed), flush=True)
+    return len(todo)
+
+
+def load(outdir):
+    """ Read every .npz in a dataset directory, in log order, and return
+    a dict of the concatenated columns. frame in the result indexes the
+    concatenated frame columns."""
+
+    parts = sorted(f for f in os.listdir(outdir) if f.endswith(".npz") and ".tmp" not in f)
+    columns = {}
+    frame_base = 0
+    width = 0
+    loaded = []
+    for f in parts:
+        with np.load(os.path.join(outdir, f)) as npz:
+            part = {name: npz[name] for name in npz.files}
+        part["frame"] = part["frame"] + frame_base
+        frame_base += len(part["frame_time"])
+        width = max(width, part["frame_data"].shape[1])
+        loaded.append(part)
+    for part in loaded:
+        pad = width - part["frame_data"].shape[1]
+        if pad:
+            part["frame_data"] = np.pad(part["frame_data"], ((0, 0), (0, pad)), "constant")
+    names = [name for name, kind in report_columns] + ["frame_time", "frame_length", "frame_data"]
+    for name in names:
+        if loaded:
+            columns[name] = np.concatenate([part[name] for part in loaded])
+        elif name == "frame_data":
+            columns[name] = np.zeros((0, 0), dtype="u1")
+        elif name in ("frame_time", "frame_length"):
+            columns[name] = np.zeros(0, dtype="f8" if name == "frame_time" else "u2")
+        else:
+            columns[name] = np.zeros(0, dtype=report_dtype[name])
+    return columns
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert intercept logs to columnar .npz files.')
+    parser.add_argument('logs', nargs='+', help='log files or directories of them')
+    parser.add_argument('--out', required=True, help='dataset directory')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--watch', type=float, default=None,
+                        help='keep running, looking for new log files every this many seconds')
+    args = parser.parse_args()
+
+    export(args.logs, args.out, args.jobs)
+    while args.watch is not None:
+        time.sleep(args.watch)
+        export(args.logs, args.out, args.jobs)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+# Thin wrapper around the bluez library calls we make on the HCI adapter.
+# Anything that needs to poke the adapter goes through here, so that a
+# fake with the same methods can stand in for it when there's no radio.
+
+import os
+import errno
+import fcntl
+from ctypes import (CDLL, get_errno)
+from ctypes.util import find_library
+
+# ioctl numbers from <bluetooth/hci.h>, _IOW('H', 201/202, int)
+HCIDEVUP = 0x400448c9
+HCIDEVDOWN = 0x400448ca
+
+
+def errno_text():
+    errnum = get_errno()
+    return "{} {}".format(
+        errno.errorcode.get(errnum, errnum),
+        os.strerror(errnum)
+    )
+
+
+class BluezHCI:
+    def __init__(self):
+        btlib = find_library("bluetooth")
+        if not btlib:
+            raise Exception(
+                "Can't find required bluetooth libraries"
+                " (need to install bluez)"
+            )
+        self.bluez = CDLL(btlib, use_errno=True)
+
+    def get_route(self):
+        return self.bluez.hci_get_route(None)
+
+    def open_dev(self, dev_id):
+        """ A socket of its own for sending commands to the adapter, so
+        they and their replies don't get mixed up with the capture socket. """
+        dd = self.bluez.hci_open_dev(dev_id)
+        if dd < 0:
+            raise Exception("Can't open hci%d: %s" % (dev_id, errno_text()))
+        return dd
+
+    def close_dev(self, dd):
+        self.bluez.hci_close_dev(dd)
+
+    def set_scan_parameters(self, fd, interval, window, timeout=1000):
+        return self.bluez.hci_le_set_scan_parameters(fd, 0, interval, window, 0, 0, timeout)
+
+    def set_scan_enable(self, fd, enable, filter_dup, timeout=1000):
+        return self.bluez.hci_le_set_scan_enable(fd, enable, filter_dup, timeout)
+
+    def reset(self, dev_id):
+        """ Recover an adapter left in a bad state by a dead Wall:
+        turn off any scan still running, then bounce the interface
+        the way `hciconfig hciN down; hciconfig hciN up` does."""
+
+        dd = self.open_dev(dev_id)
+        try:
+            # Fails harmlessly if scanning was already off or the
+            # interface is down, so don't check the result.
+            self.bluez.hci_le_set_scan_enable(dd, 0, 0, 1000)
+            fcntl.ioctl(dd, HCIDEVDOWN, dev_id)
+            try:
+                fcntl.ioctl(dd, HCIDEVUP, dev_id)
+            except OSError as e:
+                if e.errno != errno.EALREADY:
+                    raise
+        finally:
+            self.close_dev(dd)
@@ -7,12 +7,20 @@ key = b'\x4d\x92\x91\x63\x8b\x4b\x46\xd0\x67\x8d\x67\x53\xa3\xc8'
 cipher = None
 
 
-# Add the device ID to the key and initialize the cipher.
+# Make a cipher for one badge, from the key and its device ID. The
+# device ID can be a number or the two bytes themselves. Several badges
+# can be talked to at once this way, each with its own cipher.
+def make_cipher(device_id):
+    if isinstance(device_id, int):
+        device_id = device_id.to_bytes(2, byteorder='little')
+    return AES.new(key + device_id, AES.MODE_ECB)
+
+
+# Add the device ID to the key and initialize the global cipher.
 def customize_cipher(device_id):
-    global key, cipher
+    global cipher
 
-    key += device_id.to_bytes(2, byteorder='little')
-    cipher = AES.new(key, AES.MODE_ECB)
+    cipher = make_cipher(device_id)
 
 
 # Convert the first 4 bytes of a bytestring to a 32-bit number,
@@ -36,11 +44,11 @@ def increment_ctr(iv):
     return ctr_to_bytes(counter) + iv[4:]
 
 
-def decrypt_short_cryptable(cryptable):
+def decrypt_short_cryptable(cryptable, badge_cipher=None):
     iv = cryptable[0:16]
     ciphertext = cryptable[16:]
     cleartext = bytes(a ^ b for a, b in
-                       zip(ciphertext, cipher.encrypt(iv)))
+                       zip(ciphertext, (badge_cipher or cipher).encrypt(iv)))
     return cleartext
 
 
@@ -71,11 +79,11 @@ def encrypt(cleartext):
     return ciphertext
 
 
-def eval_score_characteristic(characteristic):
+def eval_score_characteristic(characteristic, badge_cipher=None):
     if len(characteristic) != 25:
         return None
 
-    cleartext = decrypt_short_cryptable(characteristic)
+    cleartext = decrypt_short_cryptable(characteristic, badge_cipher)
 
     if (cleartext[0] != 0xa6 or
         cleartext[1] != 0xe5 or
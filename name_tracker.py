@@ -0,0 +1,199 @@
+# Which badge names are most common, and which are catching on, in fixed
+# memory however many names go by over a weekend.
+#
+# A name counts once for each badge address using it, not once per
+# advertisement, so one chatty badge can't top the list. Whether an
+# (address, name) pair has been counted is remembered in a pair of Bloom
+# filters that take turns being cleared, so a badge still using its name
+# later on counts again, and most one-off noise fades away.
+#
+# Most names go by once: a badge's own made-up name, or noise. Letting each
+# of those take over a counter would push up the least count, and with it
+# the possible error, until real names were hidden too. So a name is only
+# admitted to the counters once a count-min sketch has seen it from at
+# least two addresses. The sketch's counts are halved every so often, so
+# they don't fill up with old one-offs.
+#
+# The counts are kept by the Space-Saving algorithm: a fixed number of
+# counters, and a name not being counted takes over the counter of the
+# least counted name, inheriting its count as possible error. Names that
+# really are common always have counters. Counts decay exponentially with
+# age, using forward decay: each count is added scaled up by how long
+# after a landmark time it arrived, so nothing needs to be touched to age
+# it, and scores are scaled back down when read.
+#
+# NameTracker keeps two of these: one that forgets slowly, for the most
+# common names, and one that forgets quickly, for names trending now.
+
+import math
+import time
+import hashlib
+from array import array
+
+tracked_names = 200         # counters in each summary
+common_half_life = 6 * 60 * 60
+trending_half_life = 10 * 60
+filter_bits = 1 << 16       # per Bloom filter
+filter_hashes = 3
+sketch_width = 1 << 13      # counters in each row of the count-min sketch
+sketch_depth = 4
+sketch_period = 60 * 60     # seconds between halvings of the sketch
+admit_after = 2             # addresses a name is seen from before it's counted
+rescale_after = 50          # rescale when forward decay weights reach e**this
+
+
+class PairFilter:
+    """ Remembers which (address, name) pairs have been seen in roughly
+    the last period to two periods, in fixed memory. """
+
+    def __init__(self, period, bits=filter_bits, hashes=filter_hashes):
+        self.period = period
+        self.bits = bits
+        self.hashes = hashes
+        self.current = bytearray(bits // 8)
+        self.previous = bytearray(bits // 8)
+        self.started = None
+
+    def positions(self, addr, name):
+        digest = hashlib.blake2b((addr + "\0" + name).encode("utf-8"), digest_size=4 * self.hashes).digest()
+        return [int.from_bytes(digest[4*i:4*i+4], "little") % self.bits for i in range(self.hashes)]
+
+    def add(self, addr, name, now):
+        """ Record the pair. Returns True if it hadn't been seen lately. """
+        if self.started is None:
+            self.started = now
+        elif now - self.started >= self.period:
+            if now - self.started >= 2 * self.period:
+                self.previous = bytearray(self.bits // 8)
+            else:
+                self.previous = self.current
+            self.current = bytearray(self.bits // 8)
+            self.started = now
+        positions = self.positions(addr, name)
+        seen_current = all(self.current[p >> 3] & (1 << (p & 7)) for p in positions)
+        if seen_current:
+            return False
+        for p in positions:
+            self.current[p >> 3] |= 1 << (p & 7)
+        return not all(self.previous[p >> 3] & (1 << (p & 7)) for p in positions)
+
+
+class NameSketch:
+    """ Count-min sketch of how many addresses each name has been seen
+    from, lately. May overestimate, never underestimates until halved. """
+
+    def __init__(self, period=sketch_period, width=sketch_width, depth=sketch_depth):
+        self.period = period
+        self.width = width
+        self.depth = depth
+        self.rows = [array("H", bytes(2 * width)) for i in range(depth)]
+        self.halved = None
+
+    def positions(self, name):
+        digest = hashlib.blake2b(name.encode("utf-8"), digest_size=4 * self.depth).digest()
+        return [int.from_bytes(digest[4*i:4*i+4], "little") % self.width for i in range(self.depth)]
+
+    def add(self, name, now):
+        """ Count the name once more. Returns its estimated count. """
+        if self.halved is None:
+            self.halved = now
+        elif now - self.halved >= self.period:
+            for row in self.rows:
+                for i in range(self.width):
+                    row[i] >>= 1
+            self.halved = now
+        count = None
+        for row, p in zip(self.rows, self.positions(name)):
+            if row[p] < 0xffff:
+                row[p] += 1
+            if count is None or row[p] < count:
+                count = row[p]
+        return count
+
+
+class SpaceSaving:
+    """ Approximate top names by exponentially decayed count. """
+
+    def __init__(self, half_life, size=tracked_names):
+        self.rate = math.log(2) / half_life
+        self.size = size
+        self.landmark = None
+        self.counts = {}    # name -> [count, error], in forward decay units
+
+    def add(self, name, now, weight=1.0):
+        if self.landmark is None:
+            self.landmark = now
+        elif (now - self.landmark) * self.rate > rescale_after:
+            scale = math.exp(-(now - self.landmark) * self.rate)
+            for counter in self.counts.values():
+                counter[0] *= scale
+                counter[1] *= scale
+            self.landmark = now
+        w = weight * math.exp((now - self.landmark) * self.rate)
+
+        counter = self.counts.get(name)
+        if counter is not None:
+            counter[0] += w
+        elif len(self.counts) < self.size:
+            self.counts[name] = [w, 0.0]
+        else:
+            least = min(self.counts, key=lambda n: self.counts[n][0])
+            floor = self.counts.pop(least)[0]
+            self.counts[name] = [floor + w, floor]
+
+    def score(self, name, now):
+        """ Decayed count for a name, or 0 if it isn't being counted. """
+        counter = self.counts.get(name)
+        if counter is None or self.landmark is None:
+            return 0.0
+        return counter[0] * math.exp(-(now - self.landmark) * self.rate)
+
+    def top(self, n, now):
+        """ Up to n (name, score) pairs, highest first, leaving out names
+        whose count could be mostly error. """
+        scale = math.exp(-(now - self.landmark) * self.rate) if self.landmark is not None else 0.0
+        ranked = sorted(((name, c[0] * scale) for name, c in self.counts.items() if c[0] > 2 * c[1]),
+                        key=lambda item: item[1], reverse=True)
+        return ranked[:n]
+
+
+class NameTracker:
+    def __init__(self, size=tracked_names, common=common_half_life, trending=trending_half_life,
+                 clock=time.monotonic):
+        self.clock = clock
+        self.pairs = PairFilter(trending)
+        self.sketch = NameSketch()
+        self.common_names = SpaceSaving(common, size)
+        self.trending_names = SpaceSaving(trending, size)
+        self.heard = 0      # distinct (address, name) sightings counted
+
+    def observe(self, addr, name, now=None):
+        if now is None:
+            now = self.clock()
+        if not self.pairs.add(addr, name, now):
+            return
+        self.heard += 1
+        if name in self.common_names.counts or name in self.trending_names.counts:
+            weight = 1.0
+        else:
+            seen = self.sketch.add(name, now)
+            if seen < admit_after:
+                return
+            weight = float(seen)    # counting the sightings before it was admitted
+        self.common_names.add(name, now, weight)
+        self.trending_names.add(name, now, weight)
+
+    def common(self, n):
+        """ The n most common names, as (name, score), most common first. """
+        return self.common_names.top(n, self.clock())
+
+    def trending(self, n):
+        """ Up to n names heard more lately than their long-run share
+        would suggest, most heard lately first. """
+        now = self.clock()
+        recent = self.trending_names.top(len(self.trending_names.counts), now)
+        recent_total = sum(score for name, score in recent) or 1.0
+        common_total = sum(score for name, score in self.common_names.top(self.common_names.size, now)) or 1.0
+        rising = [(name, score) for name, score in recent
+                  if score / recent_total > self.common_names.score(name, now) / common_total]
+        return rising[:n]
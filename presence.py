@@ -0,0 +1,130 @@
+# Rolling-window presence and visit statistics: how many badges have been
+# heard in the last few minutes, how fast each is advertising, and how long
+# each visit to the Wall lasts.
+#
+# Time is split into buckets, and a ring of buckets covers the window. Each
+# badge is kept in the bucket it was last heard in. When a bucket falls out
+# of the window, the badges still in it haven't been heard for a whole
+# window, so they've left and their visits are over. Every update is
+# constant time, and per-badge state is only kept for badges present now.
+
+import time
+
+import wall_metrics
+
+presence_window = 5 * 60    # seconds
+bucket_seconds = 10
+rate_smoothing = 0.1        # weight of the newest interval in the rate average
+
+metrics = wall_metrics.registry
+m_visit_length = metrics.histogram("wall_visit_seconds", "how long badges stayed in range of the Wall",
+                                   buckets=(10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400))
+
+
+class Visitor:
+    __slots__ = ("bucket", "arrived", "last_seen", "interval")
+
+    def __init__(self, bucket, now):
+        self.bucket = bucket
+        self.arrived = now
+        self.last_seen = now
+        self.interval = None    # smoothed time between advertisements
+
+
+class PresenceTracker:
+    def __init__(self, window=presence_window, bucket=bucket_seconds, clock=time.monotonic):
+        self.bucket_seconds = bucket
+        self.nbuckets = max(1, int(window / bucket))
+        self.window = self.nbuckets * bucket
+        self.clock = clock
+        self.ring = [set() for i in range(self.nbuckets)]   # badges last heard in each bucket
+        self.adverts = [0] * self.nbuckets                  # advertisements heard in each bucket
+        self.advert_total = 0
+        self.head = None        # newest bucket number
+        self.visitors = {}      # address -> Visitor, for badges present now
+        # len(visitors) as of the last update, for reading from other threads
+        self.present_count = 0
+        self.visits = 0         # completed visits
+        self.visit_time = 0.0
+        self.longest_visit = 0.0
+
+    def advance(self, now):
+        """ Move the window forward to now, ending the visits of badges
+        that have dropped out of it. """
+        b = int(now / self.bucket_seconds)
+        if self.head is None:
+            self.head = b
+            return b
+        if b - self.head >= self.nbuckets:
+            self.head = b - self.nbuckets   # everything has expired
+        while self.head < b:
+            self.head += 1
+            slot = self.head % self.nbuckets
+            for addr in self.ring[slot]:
+                self.depart(self.visitors.pop(addr))
+            self.ring[slot].clear()
+            self.advert_total -= self.adverts[slot]
+            self.adverts[slot] = 0
+        self.present_count = len(self.visitors)
+        return b
+
+    def depart(self, v):
+        length = v.last_seen - v.arrived
+        self.visits += 1
+        self.visit_time += length
+        self.longest_visit = max(self.longest_visit, length)
+        m_visit_length.observe(length)
+
+    def observe(self, addr, now):
+        b = max(self.advance(now), self.head)   # a late arrival counts as now
+        slot = b % self.nbuckets
+        self.adverts[slot] += 1
+        self.advert_total += 1
+        v = self.visitors.get(addr)
+        if v is None:
+            v = self.visitors[addr] = Visitor(b, now)
+            self.present_count = len(self.visitors)
+        else:
+            interval = now - v.last_seen
+            if v.interval is None:
+                v.interval = interval
+            else:
+                v.interval += rate_smoothing * (interval - v.interval)
+            v.last_seen = now
+            if v.bucket == b:
+                return
+            self.ring[v.bucket % self.nbuckets].discard(addr)
+            v.bucket = b
+        self.ring[slot].add(addr)
+
+    def present(self):
+        """ Number of badges heard within the window. Like every method
+        that moves the window, only for the thread doing the observing;
+        other threads can read present_count. """
+        self.advance(self.clock())
+        return len(self.visitors)
+
+    def advert_rate(self):
+        """ Advertisements per second over the window. """
+        self.advance(self.clock())
+        return self.advert_total / self.window
+
+    def badge_rate(self, addr):
+        """ Advertisements per second from one badge, or None if it's not
+        present or hasn't been heard twice yet. """
+        v = self.visitors.get(addr)
+        if v is None or not v.interval:
+            return None
+        return 1.0 / v.interval
+
+    def dwell(self, addr):
+        """ How long the badge's current visit has lasted so far. """
+        v = self.visitors.get(addr)
+        if v is None:
+            return None
+        return v.last_seen - v.arrived
+
+    def mean_visit(self):
+        if self.visits == 0:
+            return 0.0
+        return self.visit_time / self.visits
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# Rebuild the Wall's final badge table from its intercept logs, for
+# instance after fixing a parser bug, using all cores.
+#
+#   ./reprocess_logs.py logs/
+#   ./reprocess_logs.py logs/ --verify
+#
+# The log files, in the order they were written, are cut into consecutive
+# shards. Each worker replays one shard into a partial badge table, the way
+# the board does, and the partial tables are merged back together in shard
+# order, so the result is identical to replaying every intercept serially.
+# --verify does the serial replay too and checks that.
+
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import wall_logs
+from badge_parse import (
+    badgeParse,
+    BADGE_TIME,
+    BADGE_MONO,
+    BADGE_ID,
+    BADGE_IDS,
+    BADGE_NAME,
+    BADGE_CSCORE,
+    BADGE_CNT,
+    BADGE_ADDR,
+    BADGE_TYPE,
+)
+from badge_store import (merge_intercept, merge_entries)
+from badge_index import BadgeIndex
+from board_format import board_flag
+
+shards_per_job = 4      # more shards than workers, to even out the load
+
+
+def replay(logfiles, badges=None):
+    """ Replay the intercepts in logfiles, in order, into a badge table. """
+    if badges is None:
+        badges = {}
+    for logfile in logfiles:
+        for ts, data in wall_logs.read_log(logfile):
+            for badge in badgeParse(data):
+                badge[BADGE_TIME] = ts
+                badge[BADGE_MONO] = ts     # no monotonic clock in the logs
+                merge_intercept(badges, badge)
+    return badges
+
+
+def merge(tables):
+    """ Merge partial badge tables, given in log order, into one. """
+    badges = {}
+    for table in tables:
+        for addr, entry in table.items():
+            if addr in badges:
+                merge_entries(badges[addr], entry)
+            else:
+                badges[addr] = entry
+    return badges
+
+
+def shard(items, count):
+    """ Split items into at most count consecutive runs of similar size. """
+    count = max(1, min(count, len(items)))
+    size, extra = divmod(len(items), count)
+    shards = []
+    start = 0
+    for i in range(count):
+        end = start + size + (1 if i < extra else 0)
+        shards.append(items[start:end])
+        start = end
+    return shards
+
+
+def reprocess(logfiles, jobs=None):
+    if jobs == 1:
+        return replay(logfiles)
+    workers = jobs or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return merge(pool.map(replay, shard(logfiles, workers * shards_per_job)))
+
+
+def print_board(badges, out=sys.stdout):
+    """ Flagged the way the board does, except that there are no audits
+    to dispute a score. """
+    index = BadgeIndex()
+    for b in badges.values():
+        for ident in b[BADGE_IDS]:
+            index.add(b[BADGE_ADDR], b[BADGE_TYPE], ident, b[BADGE_NAME])
+    for b in sorted(badges.values(), key=lambda badge: badge[BADGE_CSCORE], reverse=True):
+        flag = board_flag(b, cloned=index.is_cloned(b[BADGE_TYPE], b[BADGE_ID]))
+        print("%s %s %-8s %6d %7d %s" % (flag, b[BADGE_ID], b[BADGE_NAME], b[BADGE_CSCORE],
+                                         b[BADGE_CNT], b[BADGE_ADDR]), file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the final badge table from intercept logs.')
+    parser.add_argument('logs', nargs='+', help='log files or directories of them')
+    parser.add_argument('--jobs', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--verify', default=False, action='store_const', const=True,
+                        help='also replay serially and check the results match')
+    args = parser.parse_args()
+
+    logfiles = wall_logs.log_files(args.logs)
+    start = time.perf_counter()
+    badges = reprocess(logfiles, args.jobs)
+    elapsed = time.perf_counter() - start
+    print_board(badges)
+    print("%d badges from %d log files in %.2fs" % (len(badges), len(logfiles), elapsed),
+          file=sys.stderr)
+
+    if args.verify:
+        start = time.perf_counter()
+        serial = replay(logfiles)
+        elapsed = time.perf_counter() - start
+        if serial != badges:
+            print("MISMATCH with serial replay", file=sys.stderr)
+            return 1
+        print("Matches serial replay (%.2fs)" % elapsed, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
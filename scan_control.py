@@ -0,0 +1,161 @@
+# Adapting how hard the adapter scans to how busy the hall is.
+#
+# Scanning flat out with duplicate filtering off hears every advertisement
+# from every badge. In a quiet hall that's what we want, but in a crowded
+# one most of those frames repeat what we've already heard, and the Pi
+# spends its time parsing them while the queue backs up. So ScanController
+# watches the rate frames come in and how full the queue is, and moves
+# between the scan settings in scan_levels: first turning on the
+# controller's duplicate filter (restarting the scan every few seconds so
+# each badge is heard again and score changes still come through), then
+# scanning less of the time.
+#
+# It steps to a lighter level as soon as the load is too high. It steps
+# back once the load has been low for a while, but only if the frame rate
+# it expects at the heavier level, from what happened when it last left
+# it, would be comfortable; otherwise it would just bounce between them.
+#
+# All the adapter commands go through an hci_control.BluezHCI, or a fake
+# with the same methods.
+
+import time
+import threading
+
+import wall_metrics
+
+# (interval, window) in 0.625ms units, duplicate filter on, seconds between
+# scan restarts when filtering
+scan_levels = (
+    (0x10, 0x10, False, None),
+    (0x10, 0x10, True, 1.0),
+    (0x10, 0x10, True, 3.0),
+    (0x20, 0x10, True, 3.0),
+    (0x40, 0x10, True, 5.0),
+)
+
+control_period = 2.0        # seconds between load measurements
+high_rate = 500             # frames/s to step to a lighter level at
+high_fill = 0.5             # or this fraction of the queue in use
+low_fill = 0.1              # queue use to step back below
+step_down_margin = 0.6      # of high_rate, for the rate expected after stepping back
+min_dwell = 30.0            # seconds at a level before stepping back
+default_gain = 3.0          # guess at how much a level cuts the frame rate, until measured
+
+metrics = wall_metrics.registry
+m_scan_changes = metrics.counter("wall_scan_changes_total", "changes of scan settings by the scan controller")
+m_scan_restarts = metrics.counter("wall_scan_restarts_total", "scans restarted to refresh the duplicate filter")
+m_scan_errors = metrics.counter("wall_scan_errors_total", "adapter commands that failed")
+
+
+class ScanController (threading.Thread):
+    def __init__(self, hci, dev_id, frames, depth, capacity, clock=time.monotonic, levels=scan_levels):
+        """ frames() is the count of frames received so far, depth() the
+        number waiting in a queue that holds capacity. """
+
+        threading.Thread.__init__(self, name="scan", daemon=True)
+        self.hci = hci
+        self.dev_id = dev_id
+        self.frames = frames
+        self.depth = depth
+        self.capacity = capacity
+        self.clock = clock
+        self.levels = levels
+        self.level = 0
+        self.gain = {}              # level -> measured frame rate before / after stepping up from it
+        self.stepped_from = None    # (level, rate) just left, until the gain is measured
+        self.stop_event = threading.Event()
+        self.dd = None
+        self.last_frames = None
+        self.last_time = None
+        self.level_since = None
+        self.last_restart = None
+        self.rate = 0.0
+        metrics.gauge("wall_scan_level", "scan controller level, 0 is scanning flat out",
+                      func=lambda: self.level)
+        metrics.gauge("wall_scan_rate", "frames per second measured by the scan controller",
+                      func=lambda: self.rate)
+
+    def command(self, name, *args):
+        err = getattr(self.hci, name)(self.dd, *args)
+        if err < 0:
+            m_scan_errors.inc()
+            print("Scan controller: %s%r failed" % (name, args), flush=True)
+            return False
+        return True
+
+    def apply(self, level):
+        """ Restart the scan with the settings for level. The parameters
+        can only be changed while the scan is off. """
+        interval, window, filter_dup, refresh = self.levels[level]
+        self.command("set_scan_enable", 0, 0)
+        self.command("set_scan_parameters", interval, window)
+        self.command("set_scan_enable", 1, 1 if filter_dup else 0)
+        self.last_restart = self.clock()
+
+    def set_level(self, level, now):
+        if level > self.level:
+            self.stepped_from = (self.level, self.rate)
+        else:
+            self.stepped_from = None
+        print("Scan level %d -> %d at %.0f frames/s" % (self.level, level, self.rate), flush=True)
+        self.level = level
+        self.level_since = now
+        m_scan_changes.inc()
+        self.apply(level)
+
+    def measure(self, now):
+        frames = self.frames()
+        if self.last_time is not None and now > self.last_time:
+            self.rate = (frames - self.last_frames) / (now - self.last_time)
+        self.last_frames = frames
+        self.last_time = now
+
+    def control(self, now):
+        """ Measure the load and change level if it calls for it. """
+        self.measure(now)
+        fill = self.depth() / self.capacity
+
+        if self.stepped_from is not None:
+            # First measurement since stepping up: see what it bought us
+            level, before = self.stepped_from
+            self.gain[level] = max(1.0, before / max(self.rate, 1.0))
+            self.stepped_from = None
+
+        if (self.rate > high_rate or fill > high_fill) and self.level < len(self.levels) - 1:
+            self.set_level(self.level + 1, now)
+        elif (self.level > 0 and fill < low_fill and now - self.level_since >= min_dwell and
+              self.rate * self.gain.get(self.level - 1, default_gain) < high_rate * step_down_margin):
+            self.set_level(self.level - 1, now)
+
+    def refresh(self, now):
+        """ With duplicate filtering on, restart the scan now and then so
+        badges we've already heard are reported again. """
+        refresh = self.levels[self.level][3]
+        if refresh is not None and now - self.last_restart >= refresh:
+            self.command("set_scan_enable", 0, 0)
+            self.command("set_scan_enable", 1, 1)
+            self.last_restart = now
+            m_scan_restarts.inc()
+
+    def run(self):
+        self.dd = self.hci.open_dev(self.dev_id)
+        try:
+            now = self.clock()
+            self.level_since = now
+            self.last_restart = now
+            self.measure(now)
+            next_control = now + control_period
+            while not self.stop_event.wait(0.25):
+                now = self.clock()
+                if now >= next_control:
+                    self.control(now)
+                    next_control = now + control_period
+                self.refresh(now)
+        finally:
+            self.hci.close_dev(self.dd)
+            self.dd = None
+
+    def stop(self):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join(2.0)
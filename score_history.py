@@ -0,0 +1,154 @@
+# Score history for each badge, so score progression can be plotted and
+# suspicious jumps spotted without re-parsing the logs.
+#
+# A sample is only stored when a badge's claimed score or trinket flag
+# changes. Samples are delta encoded in two arrays per badge: the time
+# since the previous sample in tenths of a second, and the change in score
+# shifted left one bit with the trinket flag in the low bit. That's 8 bytes
+# a sample, so even a busy badge stays in the low kilobytes.
+#
+# The export format is, for each badge: the address (6 bytes), the time of
+# the first sample (double), the number of samples (uint32), then the time
+# deltas (uint32 each) and score deltas (int32 each), all little-endian.
+
+import os
+import sys
+import struct
+from array import array
+
+TICKS_PER_SECOND = 10
+header = struct.Struct("<6sdI")
+
+
+def addr_to_bytes(addr):
+    return bytes.fromhex(addr.replace(":", ""))
+
+
+def bytes_to_addr(b):
+    return ":".join("%02x" % x for x in b)
+
+
+def to_little(a):
+    if sys.byteorder != "little":
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes()
+
+
+def from_little(typecode, data):
+    a = array(typecode)
+    a.frombytes(data)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a
+
+
+class ScoreSeries:
+    __slots__ = ("t0", "ticks", "last_score", "last_trinket", "dt", "dv")
+
+    def __init__(self, t0):
+        self.t0 = t0
+        self.ticks = 0          # time of the last sample, in ticks after t0
+        self.last_score = 0
+        self.last_trinket = 0
+        self.dt = array("I")
+        self.dv = array("i")
+
+    def append(self, t, score, trinket):
+        ticks = max(self.ticks, int(round((t - self.t0) * TICKS_PER_SECOND)))
+        self.dt.append(ticks - self.ticks)
+        self.dv.append(((score - self.last_score) << 1) | (1 if trinket else 0))
+        self.ticks = ticks
+        self.last_score = score
+        self.last_trinket = 1 if trinket else 0
+
+    def samples(self):
+        """ Yield (time, score, trinket) for each sample, oldest first. """
+        ticks = 0
+        score = 0
+        for dt, dv in zip(self.dt, self.dv):
+            ticks += dt
+            score += dv >> 1
+            yield (self.t0 + ticks / TICKS_PER_SECOND, score, dv & 1)
+
+    def __len__(self):
+        return len(self.dt)
+
+    def nbytes(self):
+        return (self.dt.itemsize + self.dv.itemsize) * len(self.dt)
+
+
+class ScoreHistory:
+    def __init__(self):
+        self.series = {}    # address -> ScoreSeries
+        # Kept as samples are added, so nbytes() can be read from another
+        # thread (the metrics server) without walking series
+        self.sample_bytes = 0
+
+    def record(self, addr, t, score, trinket):
+        """ Add a sample if the score or trinket flag has changed since the
+        last one for this address. Returns True if a sample was stored.
+        Badges without a real score (negative) aren't tracked."""
+
+        if score < 0:
+            return False
+        trinket = 1 if trinket else 0
+        s = self.series.get(addr)
+        if s is None:
+            s = self.series[addr] = ScoreSeries(t)
+        elif s.last_score == score and s.last_trinket == trinket:
+            return False
+        s.append(t, score, trinket)
+        self.sample_bytes += s.dt.itemsize + s.dv.itemsize
+        return True
+
+    def trend(self, addr, since=None):
+        """ List of (time, score, trinket) samples for one badge. """
+        s = self.series.get(addr)
+        if s is None:
+            return []
+        return [x for x in s.samples() if since is None or x[0] >= since]
+
+    def jumps(self, addr, min_rise):
+        """ Samples where the score rose by at least min_rise since the
+        previous sample, as (time, previous score, score). """
+        result = []
+        previous = None
+        for t, score, trinket in self.trend(addr):
+            if previous is not None and score - previous >= min_rise:
+                result.append((t, previous, score))
+            previous = score
+        return result
+
+    def nbytes(self):
+        return self.sample_bytes
+
+    def export(self, filename):
+        with open(filename + ".tmp", "wb") as f:
+            for addr, s in self.series.items():
+                f.write(header.pack(addr_to_bytes(addr), s.t0, len(s)))
+                f.write(to_little(s.dt))
+                f.write(to_little(s.dv))
+        os.replace(filename + ".tmp", filename)
+
+    @classmethod
+    def load(cls, filename):
+        history = cls()
+        with open(filename, "rb") as f:
+            data = f.read()
+        index = 0
+        while index < len(data):
+            raw_addr, t0, n = header.unpack_from(data, index)
+            index += header.size
+            s = ScoreSeries(t0)
+            s.dt = from_little("I", data[index:index+4*n])
+            index += 4*n
+            s.dv = from_little("i", data[index:index+4*n])
+            index += 4*n
+            for t, score, trinket in s.samples():
+                s.ticks = int(round((t - t0) * TICKS_PER_SECOND))
+                s.last_score = score
+                s.last_trinket = trinket
+            history.series[bytes_to_addr(raw_addr)] = s
+            history.sample_bytes += s.nbytes()
+        return history
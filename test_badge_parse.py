@@ -0,0 +1,96 @@
+import random
+import unittest
+
+from badge_parse import (badgeParse, ParseCache, EVT_LE_ADVERTISING_REPORT, EVT_LE_EXT_ADVERTISING_REPORT,
+                         BADGE_TYPE_JOCO, BADGE_TYPE_TRANSIO, BADGE_TYPE_ANDNXOR,
+                         BADGE_ADDR, BADGE_ID, BADGE_NAME, BADGE_CSCORE, BADGE_CTRINKET, BADGE_TYPE, BADGE_RSSI)
+from wall_loadgen import (SyntheticBadge, NoiseDevice, LoadGenerator, legacy_report, extended_report, event)
+
+
+def badge(badge_type, seed=1):
+    return SyntheticBadge(random.Random(seed), badge_type)
+
+
+def address_text(b):
+    return ":".join("%02x" % x for x in b.address)
+
+
+class BadgeParseTest(unittest.TestCase):
+    def test_one_legacy_report(self):
+        b = badge(BADGE_TYPE_JOCO)
+        b.score = 1234
+        parsed = badgeParse(event(EVT_LE_ADVERTISING_REPORT, [legacy_report(b.address, b.ad_data(), -60)]))
+        self.assertEqual(len(parsed), 1)
+        p = parsed[0]
+        self.assertEqual(p[BADGE_ADDR], address_text(b))
+        self.assertEqual(p[BADGE_ID], "%04X" % b.ident)
+        self.assertEqual(p[BADGE_NAME], b.name)
+        self.assertEqual(p[BADGE_CSCORE], 1234)
+        self.assertEqual(p[BADGE_CTRINKET], 0)
+        self.assertEqual(p[BADGE_TYPE], BADGE_TYPE_JOCO)
+        self.assertEqual(p[BADGE_RSSI], -60)
+
+    def test_multi_report_events(self):
+        badges = [badge(t, seed) for seed, t in enumerate((BADGE_TYPE_JOCO, BADGE_TYPE_TRANSIO, BADGE_TYPE_ANDNXOR))]
+        noise = NoiseDevice(random.Random(9))
+        for subevent, make_report in ((EVT_LE_ADVERTISING_REPORT, legacy_report),
+                                      (EVT_LE_EXT_ADVERTISING_REPORT, extended_report)):
+            reports = [make_report(b.address, b.ad_data(), -40 - i) for i, b in enumerate(badges)]
+            reports.insert(1, make_report(noise.address, noise.ad_data(), -50))
+            parsed = badgeParse(event(subevent, reports))
+            self.assertEqual([p[BADGE_ADDR] for p in parsed], [address_text(b) for b in badges])
+            self.assertEqual([p[BADGE_RSSI] for p in parsed], [-40, -41, -42])
+
+    def test_rssi_sign(self):
+        b = badge(BADGE_TYPE_JOCO)
+        for rssi in (-128, -1, 0, 5, 127):
+            for subevent, make_report in ((EVT_LE_ADVERTISING_REPORT, legacy_report),
+                                          (EVT_LE_EXT_ADVERTISING_REPORT, extended_report)):
+                parsed = badgeParse(event(subevent, [make_report(b.address, b.ad_data(), rssi)]))
+                self.assertEqual(parsed[0][BADGE_RSSI], rssi)
+
+    def test_fragmented_extended_data_is_skipped(self):
+        whole, partial = badge(BADGE_TYPE_JOCO, 1), badge(BADGE_TYPE_JOCO, 2)
+        fragment = bytearray(extended_report(partial.address, partial.ad_data(), -50))
+        fragment[0] |= 0x20     # data status: incomplete, more to come
+        parsed = badgeParse(event(EVT_LE_EXT_ADVERTISING_REPORT,
+                                  [bytes(fragment), extended_report(whole.address, whole.ad_data(), -50)]))
+        self.assertEqual([p[BADGE_ADDR] for p in parsed], [address_text(whole)])
+
+    def test_truncated_frames(self):
+        b = badge(BADGE_TYPE_JOCO)
+        for subevent, make_report in ((EVT_LE_ADVERTISING_REPORT, legacy_report),
+                                      (EVT_LE_EXT_ADVERTISING_REPORT, extended_report)):
+            report = make_report(b.address, b.ad_data(), -50)
+            frame = event(subevent, [report] * 2)
+            first_end = 5 + len(report)
+            for length in range(len(frame)):
+                parsed = badgeParse(frame[:length])
+                # Cut short in the first report, nothing; in the second, just the first
+                self.assertEqual(len(parsed), 0 if length < first_end else 1)
+
+    def test_garbled_frames(self):
+        rng = random.Random(3)
+        frames = LoadGenerator(badges=20, noise=5, batch=3, extended=0.5, seed=3).frames(200)
+        for frame in frames:
+            for i in range(5):
+                garbled = bytearray(frame)
+                for j in range(rng.randint(1, 4)):
+                    garbled[rng.randrange(3, len(garbled))] = rng.randrange(256)
+                self.assertIsInstance(badgeParse(bytes(garbled)), list)
+        self.assertEqual(badgeParse(b""), [])
+        self.assertEqual(badgeParse(b"\x04\x3e"), [])
+        self.assertEqual(badgeParse(b"\x04\x3e\x02\x02\x05"), [])  # says 5 reports, has none
+
+    def test_parse_cache_matches_badgeparse(self):
+        generator = LoadGenerator(badges=30, noise=10, batch=4, extended=0.3, name_churn=0.05, seed=5)
+        cache = ParseCache(size=16)     # small, so there are evictions too
+        for frame in generator.frames(2000):
+            self.assertEqual(cache.parse(frame), badgeParse(frame))
+            self.assertEqual(cache.parse(bytearray(frame)), badgeParse(frame))
+        self.assertGreater(cache.hits, 0)
+        self.assertGreater(cache.evictions, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
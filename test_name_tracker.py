@@ -0,0 +1,59 @@
+import random
+import unittest
+
+from name_tracker import (NameTracker, NameSketch)
+from wall_fakes import FakeClock
+
+
+def address(rng):
+    return ":".join("%02x" % rng.randrange(256) for i in range(6))
+
+
+class NameTrackerTest(unittest.TestCase):
+    def test_real_names_survive_one_off_noise(self):
+        """ 30 names each used by 5 to 34 badges, among 5000 names used
+        once, over three hours. """
+        rng = random.Random(44)
+        clock = FakeClock(0.0)
+        tracker = NameTracker(clock=clock)
+        duration = 3 * 60 * 60
+        real = ["real%02d" % i for i in range(30)]
+        events = []
+        for i, name in enumerate(real):
+            for badge in range(5 + i):
+                addr = address(rng)
+                start = rng.uniform(0, duration - 600)
+                for k in range(rng.randint(1, 5)):     # heard a few times while it's around
+                    events.append((start + k * rng.uniform(1, 120), addr, name))
+        for i in range(5000):
+            events.append((rng.uniform(0, duration), address(rng), "noise%04d" % i))
+        events.sort()
+        for t, addr, name in events:
+            clock.now = t
+            tracker.observe(addr, name)
+        clock.now = duration
+
+        common = [name for name, score in tracker.common(30)]
+        self.assertEqual(sorted(common), real)
+        # The most used names come first
+        self.assertLessEqual(set(common[:5]), set(real[-8:]))
+
+    def test_sketch_admits_after_two_addresses(self):
+        sketch = NameSketch(period=100)
+        self.assertEqual(sketch.add("Bob", 0), 1)
+        self.assertEqual(sketch.add("Bob", 1), 2)
+        self.assertEqual(sketch.add("Alice", 2), 1)
+        self.assertEqual(sketch.add("Bob", 150), 2)   # halved to 1 first
+
+    def test_one_off_name_is_not_counted(self):
+        clock = FakeClock(0.0)
+        tracker = NameTracker(clock=clock)
+        tracker.observe("aa:aa:aa:aa:aa:aa", "Solo")
+        tracker.observe("aa:aa:aa:aa:aa:aa", "Solo")    # same address again
+        self.assertEqual(tracker.common(10), [])
+        tracker.observe("bb:bb:bb:bb:bb:bb", "Solo")
+        self.assertEqual([name for name, score in tracker.common(10)], ["Solo"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+
+import wall_logs
+from reprocess_logs import (reprocess, replay, merge)
+from badge_parse import (BADGE_ID, BADGE_IDS, BADGE_ID_FAKED, BADGE_TYPE_JOCO)
+from wall_loadgen import LoadGenerator
+
+
+def write_logs(directory, generator, files, frames, change=None):
+    """ Write files log files of frames each, calling change(generator)
+    halfway through. Returns their names in order. """
+    t = 1526653800.0
+    for n in range(files):
+        if n == files // 2 and change is not None:
+            change(generator)
+        with open(os.path.join(directory, "201805181430%02d.log" % n), "w") as f:
+            for frame in generator.frames(frames):
+                t += 0.01
+                print("%f %s" % (t, frame.hex()), file=f)
+    return wall_logs.log_files([directory])
+
+
+class ReprocessTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.generator = LoadGenerator(badges=20, noise=5, batch=3, extended=0.2,
+                                       name_churn=0.02, layouts=(BADGE_TYPE_JOCO,), seed=7)
+        self.faker = self.generator.devices[0]
+
+        def change_id(generator):
+            self.faker.ident ^= 0x5a5a
+
+        self.files = write_logs(self.tmp.name, self.generator, 8, 300, change_id)
+        self.faker_addr = ":".join("%02x" % b for b in self.faker.address)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_parallel_matches_serial(self):
+        serial = replay(self.files)
+        self.assertEqual(reprocess(self.files, jobs=2), serial)
+        self.assertEqual(reprocess(self.files, jobs=1), serial)
+
+    def test_faked_id_kept_across_shards(self):
+        first = replay(self.files[:4])
+        second = replay(self.files[4:])
+        # Neither half sees the badge send two IDs
+        self.assertNotIn(BADGE_ID_FAKED, first[self.faker_addr])
+        self.assertNotIn(BADGE_ID_FAKED, second[self.faker_addr])
+        merged = merge([first, second])[self.faker_addr]
+        self.assertTrue(merged[BADGE_ID_FAKED])
+        self.assertEqual(len(merged[BADGE_IDS]), 2)
+        self.assertEqual(merged[BADGE_ID], "%04X" % self.faker.ident)
+        self.assertEqual(merged, replay(self.files)[self.faker_addr])
+
+
+if __name__ == "__main__":
+    unittest.main()
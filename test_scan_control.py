@@ -0,0 +1,87 @@
+import unittest
+
+import scan_control
+from scan_control import ScanController
+from wall_fakes import (FakeClock, FakeBluezHCI)
+
+
+class ScanControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock(0.0)
+        self.hci = FakeBluezHCI()
+        self.frames = 0
+        self.waiting = 0
+        self.scan = ScanController(self.hci, 0, lambda: self.frames, lambda: self.waiting, 1000,
+                                   clock=self.clock)
+        self.scan.dd = self.hci.open_dev(0)
+        self.scan.level_since = self.scan.last_restart = 0.0
+        self.scan.measure(0.0)
+
+    def load(self, rate, seconds=scan_control.control_period):
+        """ Frames arrive at rate for a while, then the controller looks. """
+        self.clock.advance(seconds)
+        self.frames += int(rate * seconds)
+        self.scan.control(self.clock())
+
+    def test_steps_up_under_load(self):
+        self.load(100)
+        self.assertEqual(self.scan.level, 0)
+        self.assertEqual(self.hci.calls, [])
+        self.load(2000)
+        self.assertEqual(self.scan.level, 1)
+        interval, window, filter_dup, refresh = scan_control.scan_levels[1]
+        self.assertEqual(self.hci.calls, [("set_scan_enable", (0, 0)),
+                                          ("set_scan_parameters", (interval, window)),
+                                          ("set_scan_enable", (1, 1))])
+
+    def test_steps_up_on_full_queue(self):
+        self.waiting = 900
+        self.load(100)
+        self.assertEqual(self.scan.level, 1)
+
+    def test_steps_back_only_when_it_would_stay_comfortable(self):
+        self.load(2000)
+        self.assertEqual(self.scan.level, 1)
+        self.load(400)      # the duplicate filter cut the rate 5 times
+        self.assertEqual(self.scan.gain[0], 5.0)
+        for i in range(20):
+            self.load(400)
+        self.assertEqual(self.scan.level, 1)    # back at level 0 would be 2000/s again
+        self.load(50)
+        self.assertEqual(self.scan.level, 0)
+
+    def test_waits_at_a_level_before_stepping_back(self):
+        self.load(2000)
+        self.load(400)
+        self.load(50)
+        self.assertEqual(self.scan.level, 1)
+        self.load(50, scan_control.min_dwell)
+        self.assertEqual(self.scan.level, 0)
+
+    def test_refreshes_filtered_scans(self):
+        self.scan.refresh(100.0)
+        self.assertEqual(self.hci.calls, [])     # not filtering at level 0
+        self.load(2000)
+        del self.hci.calls[:]
+        refresh = scan_control.scan_levels[1][3]
+        self.scan.refresh(self.clock() + refresh / 2)
+        self.assertEqual(self.hci.calls, [])
+        self.scan.refresh(self.clock() + refresh)
+        self.assertEqual(self.hci.calls, [("set_scan_enable", (0, 0)), ("set_scan_enable", (1, 1))])
+
+    def test_failed_commands_are_not_fatal(self):
+        self.hci.fail.add("set_scan_parameters")
+        self.load(2000)
+        self.assertEqual(self.scan.level, 1)
+        self.assertEqual(self.hci.calls[-1], ("set_scan_enable", (1, 1)))
+
+    def test_run_closes_its_socket(self):
+        scan = ScanController(self.hci, 0, lambda: 0, lambda: 0, 1000)
+        scan.start()
+        scan.stop()
+        self.assertFalse(scan.is_alive())
+        self.assertEqual(self.hci.open, [self.scan.dd])
+
+
+if __name__ == "__main__":
+    unittest.main()
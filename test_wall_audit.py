@@ -0,0 +1,79 @@
+import unittest
+
+from wall_audit import (ScoreAuditor, VERDICT_OK, VERDICT_DISPUTED, VERDICT_INVALID, VERDICT_FAILED)
+from wall_fakes import (FakeClock, FakeDeviceManager)
+
+
+class ScoreAuditorTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock(1000.0)
+        self.manager = FakeDeviceManager()
+        self.auditor = ScoreAuditor(self.manager, make_device=self.manager.make_device, clock=self.clock,
+                                    interval=10, connections=2, timeout=30, recheck=600)
+
+    def step(self, seconds):
+        self.clock.advance(seconds)
+        self.auditor.tick()
+
+    def test_highest_claim_first_and_rate_limited(self):
+        self.auditor.offer([("aa", "0001", 100), ("bb", "0002", 5000), ("cc", "0003", 50)])
+        self.auditor.tick()
+        self.assertEqual(list(self.manager.devices), ["bb"])
+        self.step(5)
+        self.assertEqual(list(self.manager.devices), ["bb"])
+        self.step(5)
+        self.assertEqual(list(self.manager.devices), ["bb", "aa"])
+        self.step(10)
+        self.assertEqual(len(self.manager.devices), 2)   # both connections busy
+
+    def test_verdicts(self):
+        self.auditor.offer([("aa", "0001", 100), ("bb", "0002", 5000), ("cc", "0003", 50)])
+        self.auditor.tick()
+        self.manager.devices["bb"].read(4000)
+        self.assertEqual(self.auditor.verdict("bb").verdict, VERDICT_DISPUTED)
+        self.assertTrue(self.auditor.disputed("bb"))
+
+        self.step(10)
+        self.manager.devices["aa"].read(150)
+        self.assertEqual(self.auditor.verdict("aa").verdict, VERDICT_OK)
+        self.assertFalse(self.auditor.disputed("aa"))
+
+        self.step(10)
+        self.manager.devices["cc"].read(50, device_id="9999")
+        self.assertEqual(self.auditor.verdict("cc").verdict, VERDICT_INVALID)
+        self.assertEqual([addr for addr, v in self.auditor.finished], ["bb", "aa", "cc"])
+
+    def test_garbled_read_is_invalid(self):
+        self.auditor.offer([("aa", "0001", 100)])
+        self.auditor.tick()
+        self.manager.devices["aa"].garbled()
+        self.assertTrue(self.auditor.disputed("aa"))
+
+    def test_timeout_fails_and_disconnects(self):
+        self.auditor.offer([("aa", "0001", 100)])
+        self.auditor.tick()
+        device = self.manager.devices["aa"]
+        self.step(31)
+        self.assertEqual(self.auditor.verdict("aa").verdict, VERDICT_FAILED)
+        self.assertEqual(device.disconnects, 1)
+        device.read(100)    # too late, ignored
+        self.assertEqual(self.auditor.verdict("aa").verdict, VERDICT_FAILED)
+
+    def test_failure_keeps_earlier_verdict_and_rechecks_later(self):
+        self.auditor.offer([("aa", "0001", 100)])
+        self.auditor.tick()
+        self.manager.devices["aa"].read(100)
+        self.step(300)
+        self.assertEqual(self.manager.devices["aa"].connects, 1)    # checked too recently
+        self.step(300)
+        self.assertEqual(self.manager.devices["aa"].connects, 1)    # a new device each time
+        self.manager.devices["aa"].fail()
+        self.assertEqual(self.auditor.verdict("aa").verdict, VERDICT_OK)
+        self.step(599)
+        self.assertNotIn("aa", self.auditor.active)
+        self.step(1)
+        self.assertIn("aa", self.auditor.active)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import tempfile
+import unittest
+
+import wall_bus
+from wall_bus import (BusWriter, BusReader, HEADER_SIZE, SLOT_HEADER_SIZE)
+
+SLOTS = 16
+
+
+class BusTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved_dir = wall_bus.bus_dir
+        wall_bus.bus_dir = self.tmp.name
+        self.writer = BusWriter("test", slot_size=64, slots=SLOTS)
+        self.reader = BusReader("test")
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+        wall_bus.bus_dir = self.saved_dir
+        self.tmp.cleanup()
+
+    def read_all(self):
+        messages = []
+        while True:
+            payload = self.reader.read()
+            if payload is None:
+                return messages
+            messages.append(bytes(payload))
+
+    def test_in_order(self):
+        self.assertIsNone(self.reader.read())
+        for i in range(10):
+            self.writer.publish(b"message %d" % i)
+        self.assertEqual(self.read_all(), [b"message %d" % i for i in range(10)])
+        self.writer.publish(b"one more")
+        self.assertEqual(self.read_all(), [b"one more"])
+        self.assertEqual((self.reader.overruns, self.reader.missed, self.reader.corrupt), (0, 0, 0))
+
+    def test_too_long_is_dropped(self):
+        self.writer.publish(b"x" * (64 - SLOT_HEADER_SIZE + 1))
+        self.writer.publish(b"fits")
+        self.assertEqual(self.writer.dropped, 1)
+        self.assertEqual(self.read_all(), [b"fits"])
+
+    def test_lapped_reader_skips_to_oldest(self):
+        self.writer.publish(b"0")
+        self.assertEqual(self.read_all(), [b"0"])
+        for i in range(1, 41):
+            self.writer.publish(b"%d" % i)
+        head = self.writer.head
+        oldest = self.reader.oldest(head)
+        messages = self.read_all()
+        self.assertEqual(messages, [b"%d" % i for i in range(oldest, head)])
+        self.assertEqual(self.reader.overruns, 1)
+        self.assertEqual(self.reader.missed, oldest - 1)
+        self.assertEqual(self.reader.cursor, head)
+
+    def test_corrupt_payload_is_counted_and_skipped(self):
+        for i in range(3):
+            self.writer.publish(b"message %d" % i)
+        offset = HEADER_SIZE + 1 * self.writer.slot_size + SLOT_HEADER_SIZE
+        self.writer.map[offset] ^= 0xff     # stamp still right, CRC now wrong
+        self.assertEqual(self.read_all(), [b"message 0", b"message 2"])
+        self.assertEqual(self.reader.corrupt, 1)
+        self.assertEqual(self.reader.missed, 1)
+        self.assertEqual(self.reader.overruns, 0)
+
+    def test_from_start(self):
+        for i in range(40):
+            self.writer.publish(b"%d" % i)
+        reader = BusReader("test", from_start=True)
+        first = reader.oldest(self.writer.head)
+        self.assertEqual(bytes(reader.read()), b"%d" % first)
+        reader.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import signal
+import unittest
+
+import wall_supervisor
+from wall_supervisor import (Supervisor, Component)
+from wall_fakes import (FakeClock, FakeProcessControl, FakeHeartbeatSocket, FakeBluezHCI)
+
+
+class SupervisorTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock(1000.0)
+        self.procs = FakeProcessControl()
+        self.hci = FakeBluezHCI()
+        self.hb = FakeHeartbeatSocket()
+        self.wall = Component("wall", ["./walloftio.py"], heartbeat_timeout=15.0, needs_adapter=True)
+        self.trinket = Component("trinket", ["./trinketctl.py"], prestart=["./resetnfc.py"],
+                                 stop_signal=signal.SIGHUP)
+        self.sup = Supervisor([self.wall, self.trinket], hci=self.hci, procs=self.procs,
+                              dev_id=0, clock=self.clock, hbsock=self.hb)
+
+    def test_starts_everything_and_resets_adapter_for_the_wall(self):
+        self.sup.tick()
+        self.assertEqual([p.argv for p in self.procs.spawned], [["./walloftio.py"], ["./trinketctl.py"]])
+        self.assertEqual(self.hci.resets, [0])
+        self.assertEqual(self.procs.ran, [["./resetnfc.py"]])
+
+    def test_lost_heartbeat_restarts_only_the_wall(self):
+        self.sup.tick()
+        wall_proc = self.wall.proc
+        trinket_proc = self.trinket.proc
+        self.hb.send_beat()
+        self.clock.advance(1)
+        self.sup.tick()
+        self.clock.advance(20)
+        self.sup.tick()
+        self.assertEqual(wall_proc.signals, [signal.SIGINT])
+        self.assertEqual(self.wall.failures, {"heartbeat lost": 1})
+        self.assertIs(self.trinket.proc, trinket_proc)
+
+        self.clock.advance(self.wall.restart_delay)
+        self.sup.tick()
+        self.assertIsNot(self.wall.proc, None)
+        self.assertEqual(len(self.hci.resets), 2)
+        self.hb.send_beat()
+        self.clock.advance(0.5)
+        self.sup.tick()
+        self.assertTrue(self.wall.healthy())
+        self.assertEqual(len(self.wall.restart_times), 1)
+
+    def test_exit_backs_off(self):
+        self.sup.tick()
+        self.procs.exit(self.trinket.proc, 1)
+        self.clock.advance(1)
+        self.sup.tick()
+        self.assertEqual(self.trinket.failures, {"exit 1": 1})
+        self.assertEqual(self.trinket.restart_delay, wall_supervisor.min_restart_delay * 2)
+        self.assertIsNone(self.trinket.proc)
+
+    def test_failed_adapter_reset_is_not_fatal(self):
+        self.hci.fail.add("reset")
+        self.sup.tick()
+        self.assertIsNotNone(self.wall.proc)
+
+    def test_spawn_failure_backs_off_without_stopping_the_rest(self):
+        self.procs.missing.add("./walloftio.py")
+        self.sup.tick()
+        self.assertIsNone(self.wall.proc)
+        self.assertEqual(self.wall.failures, {"spawn failed": 1})
+        self.assertIsNotNone(self.trinket.proc)
+        delay = self.wall.restart_delay
+        self.assertEqual(delay, wall_supervisor.min_restart_delay * 2)
+
+        self.clock.advance(delay)
+        self.sup.tick()
+        self.assertEqual(self.wall.failures, {"spawn failed": 2})
+        self.assertEqual(self.wall.restart_delay, delay * 2)
+        self.assertEqual(self.trinket.proc.signals, [])
+
+        self.procs.missing.clear()
+        self.clock.advance(self.wall.restart_delay)
+        self.sup.tick()
+        self.assertIsNotNone(self.wall.proc)
+
+    def test_prestart_failure_is_a_spawn_failure(self):
+        self.procs.missing.add("./resetnfc.py")
+        self.sup.tick()
+        self.assertIsNone(self.trinket.proc)
+        self.assertEqual(self.trinket.failures, {"spawn failed": 1})
+        self.assertIsNotNone(self.wall.proc)
+
+
+if __name__ == "__main__":
+    unittest.main()
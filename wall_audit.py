@@ -0,0 +1,193 @@
+# Checking the scores badges advertise against the scores they report over
+# GATT, in the background while the Wall runs.
+#
+# The board ranks badges by the score they claim in their advertisements,
+# which is whatever they say it is. The encrypted 2e15 characteristic is
+# the only score that can be trusted, but reading it means connecting to
+# the badge, which is slow and can only be done a few at a time. So the
+# ScoreAuditor picks which badges to check: the higher a badge's claimed
+# score and the longer since it was last checked, the sooner it gets
+# connected to. Connections are started no faster than audit_interval,
+# with at most max_connections at once, and a badge whose claim is higher
+# than its real score is marked disputed.
+#
+# The Tk thread offers candidates from the badge table and reads verdicts.
+# Everything else, including the GATT callbacks, happens on the thread
+# running the gatt DeviceManager's main loop, which calls tick() every
+# second. Nothing here imports gatt, so it can be run against a fake
+# DeviceManager and fake devices.
+
+import time
+import threading
+from collections import deque
+
+import wall_metrics
+
+audit_interval = 10         # seconds between starting connections
+max_connections = 2
+connect_timeout = 30        # seconds before giving up on a badge
+recheck_after = 15 * 60     # don't check a badge again sooner than this
+never_checked = 60 * 60     # how stale a badge that's never been checked counts as
+
+VERDICT_OK = "ok"
+VERDICT_DISPUTED = "disputed"   # claims a higher score than it has
+VERDICT_INVALID = "invalid"     # didn't decrypt, or a different device ID
+VERDICT_FAILED = "failed"       # couldn't connect or read
+
+metrics = wall_metrics.registry
+m_audits = {verdict: metrics.counter("wall_audits_total", "GATT score audits finished", {"verdict": verdict})
+            for verdict in (VERDICT_OK, VERDICT_DISPUTED, VERDICT_INVALID, VERDICT_FAILED)}
+m_audit_time = metrics.histogram("wall_audit_seconds", "time from connecting to a badge to its score audit verdict",
+                                 buckets=(0.5, 1, 2, 5, 10, 20, 30, 60))
+
+
+class Audit:
+    __slots__ = ("addr", "badge_id", "claimed", "started", "device")
+
+    def __init__(self, addr, badge_id, claimed, started):
+        self.addr = addr
+        self.badge_id = badge_id
+        self.claimed = claimed
+        self.started = started
+        self.device = None
+
+
+class Verdict:
+    __slots__ = ("verdict", "checked", "claimed", "score", "lld")
+
+    def __init__(self, verdict, checked, claimed, score=None, lld=None):
+        self.verdict = verdict
+        self.checked = checked
+        self.claimed = claimed
+        self.score = score
+        self.lld = lld
+
+
+def default_device(addr, manager, auditor, badge_id):
+    import wall_gatt
+    return wall_gatt.AuditDevice(addr, manager, auditor, badge_id)
+
+
+class ScoreAuditor:
+    def __init__(self, manager, make_device=default_device, clock=time.monotonic,
+                 interval=audit_interval, connections=max_connections, timeout=connect_timeout,
+                 recheck=recheck_after):
+        self.manager = manager
+        self.make_device = make_device
+        self.clock = clock
+        self.interval = interval
+        self.connections = connections
+        self.timeout = timeout
+        self.recheck = recheck
+        self.lock = threading.Lock()
+        self.candidates = {}        # address -> (badge ID, claimed score), from the Tk thread
+        self.active = {}            # address -> Audit, connections in progress
+        self.verdicts = {}          # address -> latest Verdict
+        self.finished = deque()     # (address, Verdict) for the Tk thread to pick up
+        self.last_start = None
+        metrics.gauge("wall_audits_active", "GATT score audits in progress", func=lambda: len(self.active))
+
+    def offer(self, candidates):
+        """ Replace the badges to choose from with (address, badge ID,
+        claimed score) for each auditable badge on the board. """
+        with self.lock:
+            self.candidates = {addr: (badge_id, claimed) for addr, badge_id, claimed in candidates}
+
+    def priority(self, addr, claimed, now):
+        v = self.verdicts.get(addr)
+        staleness = never_checked if v is None else now - v.checked
+        if staleness < self.recheck:
+            return None
+        return (claimed + 1) * staleness
+
+    def choose(self, now):
+        """ The candidate most in need of checking, or None. """
+        best = None
+        best_priority = None
+        with self.lock:
+            candidates = list(self.candidates.items())
+        for addr, (badge_id, claimed) in candidates:
+            if addr in self.active:
+                continue
+            p = self.priority(addr, claimed, now)
+            if p is not None and (best_priority is None or p > best_priority):
+                best = (addr, badge_id, claimed)
+                best_priority = p
+        return best
+
+    def tick(self):
+        """ Give up on connections that have taken too long, and start a
+        new one if there's room and it's been long enough since the last.
+        Returns True so it can be used as a GLib timeout callback. """
+        now = self.clock()
+        for audit in list(self.active.values()):
+            if now - audit.started > self.timeout:
+                self.finish(audit.addr, VERDICT_FAILED)
+                try:
+                    audit.device.disconnect()
+                except Exception as e:
+                    print("Audit of %s: disconnect failed: %s" % (audit.addr, e), flush=True)
+
+        if len(self.active) >= self.connections:
+            return True
+        if self.last_start is not None and now - self.last_start < self.interval:
+            return True
+        chosen = self.choose(now)
+        if chosen is None:
+            return True
+        addr, badge_id, claimed = chosen
+        audit = Audit(addr, badge_id, claimed, now)
+        self.active[addr] = audit
+        self.last_start = now
+        try:
+            audit.device = self.make_device(addr, self.manager, self, badge_id)
+            audit.device.connect()
+        except Exception as e:
+            print("Audit of %s: can't connect: %s" % (addr, e), flush=True)
+            self.finish(addr, VERDICT_FAILED)
+        return True
+
+    def result(self, addr, result):
+        """ Called by the device with the decrypted (device ID, score, lld)
+        from the score characteristic, or None if it didn't decrypt. """
+        audit = self.active.get(addr)
+        if audit is None:
+            return      # timed out already
+        if result is None:
+            self.finish(addr, VERDICT_INVALID)
+            return
+        device_id, score, lld = result
+        if device_id.lower() != audit.badge_id.lower():
+            self.finish(addr, VERDICT_INVALID, score, lld)
+        elif audit.claimed > score:
+            self.finish(addr, VERDICT_DISPUTED, score, lld)
+        else:
+            # Advertisements can lag behind a score that's just gone up
+            self.finish(addr, VERDICT_OK, score, lld)
+
+    def failed(self, addr, reason):
+        """ Called by the device when it couldn't connect or read. """
+        if addr in self.active:
+            print("Audit of %s failed: %s" % (addr, reason), flush=True)
+            self.finish(addr, VERDICT_FAILED)
+
+    def finish(self, addr, verdict, score=None, lld=None):
+        audit = self.active.pop(addr)
+        now = self.clock()
+        v = Verdict(verdict, now, audit.claimed, score, lld)
+        previous = self.verdicts.get(addr)
+        if verdict == VERDICT_FAILED and previous is not None and previous.verdict != VERDICT_FAILED:
+            # Keep what we know, but try again after the usual wait
+            previous.checked = now
+        else:
+            self.verdicts[addr] = v
+        self.finished.append((addr, v))
+        m_audits[verdict].inc()
+        m_audit_time.observe(now - audit.started)
+
+    def disputed(self, addr):
+        v = self.verdicts.get(addr)
+        return v is not None and v.verdict in (VERDICT_DISPUTED, VERDICT_INVALID)
+
+    def verdict(self, addr):
+        return self.verdicts.get(addr)
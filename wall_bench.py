@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# Benchmarks for the Wall's processing path, run on a laptop or the Pi.
+#
+#   ./wall_bench.py parse-cache LOGS...
+#   ./wall_bench.py all
+#   ./wall_bench.py parse|aggregate|log|render
+#
+# LOGS are intercept log files or directories of them, as written by
+# the Wall. The other benchmarks run on frames from the synthetic load
+# generator, so they need no logs and no badges, and check each stage
+# against the throughput and latency targets below. "all" exits with
+# status 1 if any stage misses its targets, so run it before the con.
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import wall_logs
+import wall_loadgen
+from badge_parse import (
+    badgeParse,
+    ParseCache,
+    parse_cache_size,
+    BADGE_TIME,
+    BADGE_MONO,
+    BADGE_ADDR,
+    BADGE_ID,
+    BADGE_NAME,
+    BADGE_TYPE,
+    BADGE_CSCORE,
+    BADGE_CTRINKET,
+)
+from badge_store import (BadgeStore, merge_intercept, badge_memory_cap)
+from badge_index import BadgeIndex
+from board_format import (board_flag, board_line)
+from score_history import ScoreHistory
+from presence import PresenceTracker
+
+# What a Pi Zero W has to keep up with in a crowded hall. Rates are per
+# second; latencies are per frame or intercept, in seconds.
+targets = {
+    "parse":     {"rate": 3000, "p99": 0.002},
+    "aggregate": {"rate": 3000, "p99": 0.002},
+    "log":       {"rate": 5000, "max": 0.5},
+    "render":    {"max": 0.1},
+}
+
+
+def load_frames(paths):
+    frames = []
+    for filename in wall_logs.log_files(paths):
+        frames.extend(data for ts, data in wall_logs.read_log(filename))
+    return frames
+
+
+def time_parse(parse, frames, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        for data in frames:
+            parse(data)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_parse_cache(args):
+    frames = load_frames(args.logs)
+    if not frames:
+        print("No intercepts found")
+        return 1
+    print("%d intercepts" % len(frames))
+
+    plain = time_parse(badgeParse, frames, args.repeat)
+    print("%-18s %8.3fs  %9.0f/s" % ("badgeParse", plain, len(frames) / plain))
+
+    # A fresh cache for each run, so the misses are counted too
+    caches = []
+
+    def cached_run(data, caches=caches):
+        return caches[-1].parse(data)
+
+    best = None
+    for i in range(args.repeat):
+        caches.append(ParseCache(args.size))
+        elapsed = time_parse(cached_run, frames, 1)
+        if best is None or elapsed < best:
+            best = elapsed
+    stats = caches[-1].stats()
+    print("%-18s %8.3fs  %9.0f/s" % ("ParseCache(%d)" % args.size, best, len(frames) / best))
+    print("  hit rate %.1f%%, %d hits, %d misses, %d evictions" %
+          (stats["hit_rate"] * 100, stats["hits"], stats["misses"], stats["evictions"]))
+    print("  speedup %.2fx" % (plain / best))
+    return 0
+
+
+def percentile(times, fraction):
+    times = sorted(times)
+    return times[min(len(times) - 1, int(len(times) * fraction))]
+
+
+def timed(func, items):
+    """ Call func on each item. Returns (total time, list of per-item times). """
+    times = []
+    clock = time.perf_counter
+    start = clock()
+    for item in items:
+        t = clock()
+        func(item)
+        times.append(clock() - t)
+    return (clock() - start, times)
+
+
+def synthetic_frames(args):
+    generator = wall_loadgen.LoadGenerator(badges=args.badges, noise=args.badges // 5,
+                                           batch=args.batch, seed=args.seed)
+    return generator.frames(args.frames)
+
+
+def synthetic_badges(args):
+    badges = []
+    for n, data in enumerate(synthetic_frames(args)):
+        for badge in badgeParse(data):
+            badge[BADGE_TIME] = badge[BADGE_MONO] = n * 0.01
+            badges.append(badge)
+    return badges
+
+
+def check(stage, results):
+    """ Print results and compare them with the stage's targets. """
+    target = targets[stage]
+    ok = True
+    parts = []
+    for key, value in results.items():
+        goal = target.get(key)
+        if goal is None:
+            parts.append("%s %s" % (key, value if isinstance(value, int) else "%.6g" % value))
+            continue
+        met = value >= goal if key == "rate" else value <= goal
+        ok = ok and met
+        parts.append("%s %.6g (%s %.6g)" % (key, value, ">=" if key == "rate" else "<=", goal) +
+                     ("" if met else " MISSED"))
+    print("%-10s %-4s %s" % (stage, "ok" if ok else "FAIL", ", ".join(parts)), flush=True)
+    return ok
+
+
+def bench_parse(args):
+    frames = synthetic_frames(args)
+    cache = ParseCache()
+    elapsed, times = timed(cache.parse, frames)
+    return check("parse", {"rate": len(frames) / elapsed, "p99": percentile(times, 0.99),
+                           "hit_rate": cache.hit_rate()})
+
+
+def bench_aggregate(args):
+    badges = synthetic_badges(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        store = BadgeStore(filename=os.path.join(tmp, "badges.cold"), clock=lambda: 0.0)
+        index = BadgeIndex()
+        history = ScoreHistory()
+        presence = PresenceTracker(clock=lambda: 0.0)
+
+        def aggregate(badge):
+            # What the board and presence panel do with each intercept
+            index.add(badge[BADGE_ADDR], badge[BADGE_TYPE], badge[BADGE_ID], badge[BADGE_NAME])
+            history.record(badge[BADGE_ADDR], badge[BADGE_TIME], badge[BADGE_CSCORE], badge[BADGE_CTRINKET])
+            merge_intercept(store, badge)
+            presence.observe(badge[BADGE_ADDR], badge[BADGE_MONO])
+
+        elapsed, times = timed(aggregate, badges)
+        store.close()
+    return check("aggregate", {"rate": len(badges) / elapsed, "p99": percentile(times, 0.99)})
+
+
+def bench_log(args):
+    frames = synthetic_frames(args)
+    with tempfile.TemporaryDirectory() as tmp:
+        logger = wall_logs.Logger(tmp)
+        writeouts = []
+        writeout = logger._writeout
+
+        def timed_writeout():
+            start = time.perf_counter()
+            writeout()
+            writeouts.append(time.perf_counter() - start)
+
+        logger._writeout = timed_writeout
+        now = time.time()
+        elapsed, times = timed(logger.intercept, [(now, data, 0.0) for data in frames])
+    return check("log", {"rate": len(frames) / elapsed, "max": max(writeouts, default=0.0)})
+
+
+def board_lines(badges, timenow):
+    """ The board's text, the way BadgeDisplay.update_display builds it
+    (no audits or clone index here, so just the flags a badge carries). """
+    return [board_line(b, board_flag(b), timenow)
+            for b in sorted(badges, key=lambda badge: badge[BADGE_CSCORE], reverse=True)]
+
+
+def bench_render(args):
+    store = {}
+    for badge in synthetic_badges(args):
+        merge_intercept(store, badge)
+    rows = list(store.values())
+    rows = (rows * (args.rows // max(1, len(rows)) + 1))[:args.rows]
+
+    try:
+        from tkinter import Tk, Canvas, NW
+        root = Tk()
+    except Exception as e:
+        print("render     skipped, no Tk display (%s)" % e, flush=True)
+        return True
+    canvas = Canvas(root, width=1080, height=750)
+    text = canvas.create_text(0, 0, anchor=NW, text="", font=("Droid Sans Mono", 24))
+    canvas.pack()
+
+    def redraw(i):
+        canvas.itemconfigure(text, text="\n".join(board_lines(rows, time.monotonic())))
+        root.update_idletasks()
+
+    elapsed, times = timed(redraw, range(args.repeat))
+    root.destroy()
+    return check("render", {"rows": len(rows), "max": max(times)})
+
+
+stages = {
+    "parse": bench_parse,
+    "aggregate": bench_aggregate,
+    "log": bench_log,
+    "render": bench_render,
+}
+
+
+def bench_stage(args):
+    return 0 if stages[args.bench](args) else 1
+
+
+def bench_all(args):
+    ok = True
+    for stage in stages.values():
+        ok = stage(args) and ok
+    return 0 if ok else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for the Wall of Trans-Ionospheric.')
+    sub = parser.add_subparsers(dest='bench')
+    p = sub.add_parser('parse-cache', help='badgeParse with and without ParseCache on recorded logs')
+    p.add_argument('logs', nargs='+')
+    p.add_argument('--size', type=int, default=parse_cache_size)
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_parse_cache)
+
+    for name, help in (("all", "every stage below, checked against its targets"),
+                       ("parse", "ParseCache on synthetic frames"),
+                       ("aggregate", "badge table, ID index, score history and presence updates"),
+                       ("log", "writing intercept logs"),
+                       ("render", "redrawing a full board (needs a display)")):
+        p = sub.add_parser(name, help=help)
+        p.add_argument('--badges', type=int, default=300, help='synthetic badges')
+        p.add_argument('--frames', type=int, default=20000, help='frames to generate')
+        p.add_argument('--batch', type=int, default=1, help='most advertising reports per frame')
+        p.add_argument('--rows', type=int, default=badge_memory_cap, help='board rows to render')
+        p.add_argument('--repeat', type=int, default=10, help='board redraws to time')
+        p.add_argument('--seed', type=int, default=1)
+        p.set_defaults(func=bench_all if name == "all" else bench_stage)
+    args = parser.parse_args()
+    if args.bench is None:
+        parser.print_help()
+        return 1
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# Shared-memory rings the Wall publishes what it captures into, so other
+# programs on the Pi can follow along without scanning for themselves or
+# waiting for a log file to be written.
+#
+# There are two rings. "raw" has every HCI frame the capture thread
+# receives, with its receive times. "parsed" has every badge advertisement
+# the Wall has parsed out of them. Each ring is a file in /dev/shm mapped
+# into memory by the Wall, which is the only writer, and by any number of
+# readers, each with a cursor of its own:
+#
+#   reader = wall_bus.BusReader("parsed")
+#   for badge in reader.follow(decode=wall_bus.decode_badge):
+#       ...
+#
+# or to watch from the shell:
+#
+#   ./wall_bus.py parsed
+#
+# The ring is a header and a fixed number of fixed-size slots. Message n
+# goes in slot n % slots. Each slot starts with a stamp, the message
+# length and a CRC-32 of the message: the writer sets the stamp to 0,
+# writes the message, length and CRC, then sets the stamp to n + 1; then
+# it advances the head count in the header. A reader wanting message n
+# copies the slot out and checks the stamp was n + 1 both before and
+# after, and that the copy matches its CRC. If the writer has lapped it,
+# the stamp is wrong, and the reader counts the messages it missed and
+# skips ahead to the oldest ones still there. No locks, and writing is
+# only memory copies: no system calls in the capture loop.
+#
+# Python gives no guarantee about the order other processes see the
+# writer's stores in, and on a multi-core Pi (3, 4, Zero 2) a reader on
+# another core might see the new stamp before all of the message. The
+# CRC catches that: a reader that gets a stamp it wants but a message
+# that doesn't match tries again, then counts it as missed.
+
+import os
+import sys
+import time
+import mmap
+import zlib
+import struct
+import tempfile
+
+from badge_parse import (
+    BADGE_ADDR,
+    BADGE_ID,
+    BADGE_NAME,
+    BADGE_YEAR,
+    BADGE_TYPE,
+    BADGE_CSCORE,
+    BADGE_CTRINKET,
+    BADGE_RSSI,
+    BADGE_TIME,
+    BADGE_MONO,
+)
+
+MAGIC = b"WALLBUS2"
+header = struct.Struct("<8sIIQQ")   # magic, slot size, slots, generation, head
+HEADER_SIZE = 64
+HEAD_OFFSET = 24
+slot_header = struct.Struct("<QII")  # stamp, length, CRC-32 of the message
+SLOT_HEADER_SIZE = 16
+
+bus_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+bus_slot_size = 512     # an HCI event is at most 258 bytes
+bus_slots = 4096
+read_retries = 3        # times to re-read a message that fails its CRC
+
+raw_record = struct.Struct("<dd")   # wall clock time, monotonic time; then the frame
+badge_record = struct.Struct("<dd6sHiib4s4sB")  # then the name
+
+
+def bus_path(name):
+    return os.path.join(bus_dir, "wall_%s" % name)
+
+
+def encode_raw(ts, mono, data):
+    return raw_record.pack(ts, mono) + data
+
+
+def decode_raw(payload):
+    ts, mono = raw_record.unpack_from(payload)
+    return (ts, bytes(payload[raw_record.size:]), mono)
+
+
+def encode_badge(badge):
+    name = badge[BADGE_NAME].encode("utf-8")
+    return badge_record.pack(badge[BADGE_TIME], badge[BADGE_MONO],
+                             bytes.fromhex(badge[BADGE_ADDR].replace(":", "")),
+                             badge[BADGE_TYPE], badge[BADGE_CSCORE], badge[BADGE_CTRINKET],
+                             badge.get(BADGE_RSSI, 0),
+                             badge[BADGE_ID].encode("ascii", "replace"),
+                             badge[BADGE_YEAR].encode("ascii", "replace"),
+                             len(name)) + name
+
+
+def decode_badge(payload):
+    (ts, mono, addr, typ, score, trinket, rssi, ident, year,
+     name_length) = badge_record.unpack_from(payload)
+    name = bytes(payload[badge_record.size:badge_record.size + name_length])
+    return {BADGE_ADDR: ":".join("%02x" % b for b in addr),
+            BADGE_ID: ident.decode("ascii"),
+            BADGE_NAME: name.decode("utf-8", "replace"),
+            BADGE_YEAR: year.decode("ascii"),
+            BADGE_TYPE: typ,
+            BADGE_CSCORE: score,
+            BADGE_CTRINKET: trinket,
+            BADGE_RSSI: rssi,
+            BADGE_TIME: ts,
+            BADGE_MONO: mono}
+
+
+class BusWriter:
+    def __init__(self, name, slot_size=bus_slot_size, slots=bus_slots):
+        self.path = bus_path(name)
+        self.slot_size = slot_size
+        self.slots = slots
+        self.max_length = slot_size - SLOT_HEADER_SIZE
+        size = HEADER_SIZE + slot_size * slots
+        # A new file each time, so readers of an old Wall's ring keep theirs
+        tmp = self.path + ".tmp"
+        fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.head = 0
+        self.generation = time.time_ns()
+        header.pack_into(self.map, 0, MAGIC, slot_size, slots, self.generation, 0)
+        os.replace(tmp, self.path)
+        self.dropped = 0    # messages too long for a slot
+
+    def publish(self, payload):
+        length = len(payload)
+        if length > self.max_length:
+            self.dropped += 1
+            return
+        n = self.head
+        offset = HEADER_SIZE + (n % self.slots) * self.slot_size
+        m = self.map
+        struct.pack_into("<Q", m, offset, 0)
+        m[offset + SLOT_HEADER_SIZE:offset + SLOT_HEADER_SIZE + length] = payload
+        struct.pack_into("<II", m, offset + 8, length, zlib.crc32(payload))
+        struct.pack_into("<Q", m, offset, n + 1)
+        self.head = n + 1
+        struct.pack_into("<Q", m, HEAD_OFFSET, n + 1)
+
+    def close(self):
+        self.map.close()
+
+
+class BusReader:
+    def __init__(self, name, from_start=False):
+        """ Start with the next message published, or with the oldest
+        one still in the ring if from_start. """
+        self.path = bus_path(name)
+        self.map = None
+        self.overruns = 0   # times the writer lapped us
+        self.missed = 0     # messages lost to that, or to failing the CRC
+        self.corrupt = 0    # messages that kept failing the CRC
+        self.attach(from_start)
+
+    def attach(self, from_start=False):
+        if self.map is not None:
+            self.map.close()
+        with open(self.path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.slot_size, self.slots, self.generation, head = header.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise Exception("%s is not a Wall bus" % self.path)
+        self.cursor = self.oldest(head) if from_start else head
+
+    def oldest(self, head):
+        # Leave a little room, since the writer may be filling the oldest slot
+        return max(0, head - self.slots + self.slots // 16)
+
+    def head(self):
+        return struct.unpack_from("<Q", self.map, HEAD_OFFSET)[0]
+
+    def read(self):
+        """ The next message as a bytes object, or None if there isn't
+        one yet. """
+        while True:
+            n = self.cursor
+            offset = HEADER_SIZE + (n % self.slots) * self.slot_size
+            for attempt in range(read_retries):
+                stamp, length, crc = slot_header.unpack_from(self.map, offset)
+                if stamp != n + 1 or length > self.slot_size - SLOT_HEADER_SIZE:
+                    break
+                payload = self.map[offset + SLOT_HEADER_SIZE:offset + SLOT_HEADER_SIZE + length]
+                if struct.unpack_from("<Q", self.map, offset)[0] != n + 1:
+                    break
+                if zlib.crc32(payload) == crc:
+                    self.cursor = n + 1
+                    return payload
+            else:
+                # The right stamp, but never a whole message to go with it
+                self.corrupt += 1
+                self.missed += 1
+                self.cursor = n + 1
+                continue
+            head = self.head()
+            if head <= n:
+                return None
+            # Overwritten, or being overwritten, before we got to it
+            skip_to = self.oldest(head)
+            self.overruns += 1
+            self.missed += max(1, skip_to - n)
+            self.cursor = max(skip_to, n + 1)
+
+    def restarted(self):
+        """ Whether the Wall has started a new ring since we attached. """
+        try:
+            with open(self.path, "rb") as f:
+                magic, slot_size, slots, generation, head = header.unpack(f.read(header.size))
+        except (OSError, struct.error):
+            return False
+        return generation != self.generation
+
+    def follow(self, decode=bytes, interval=0.01):
+        """ Yield messages as they arrive, forever. """
+        idle = 0
+        while True:
+            payload = self.read()
+            if payload is None:
+                time.sleep(interval)
+                idle += 1
+                if idle * interval >= 5.0:
+                    idle = 0
+                    if self.restarted():
+                        self.attach(from_start=True)
+                continue
+            idle = 0
+            yield decode(payload)
+
+    def close(self):
+        self.map.close()
+
+
+def main():
+    name = sys.argv[1] if len(sys.argv) > 1 else "parsed"
+    reader = BusReader(name)
+    missed = 0
+    for payload in reader.follow():
+        if reader.missed != missed:
+            print("... missed %d" % (reader.missed - missed))
+            missed = reader.missed
+        if name == "parsed":
+            b = decode_badge(payload)
+            print("%f %s %s %-8s %6d %4d" % (b[BADGE_TIME], b[BADGE_ADDR], b[BADGE_ID],
+                                             b[BADGE_NAME], b[BADGE_CSCORE], b[BADGE_RSSI]))
+        else:
+            ts, data, mono = decode_raw(payload)
+            print("%f %s" % (ts, data.hex()))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# Stand-ins for the things the Wall talks to (child processes, the HCI
+# adapter, the clock), for running its parts without the hardware. Each
+# has the same methods as the real thing and records what it was asked
+# to do.
+
+
+class FakeClock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class FakeProcess:
+    def __init__(self, argv):
+        self.argv = argv
+        self.returncode = None
+        self.signals = []
+
+
+class FakeProcessControl:
+    """ In place of wall_supervisor.ProcessControl. Children run until
+    exit() is called on them. Programs in missing fail to start. """
+
+    def __init__(self, missing=()):
+        self.spawned = []
+        self.ran = []
+        self.missing = set(missing)     # programs that can't be found
+
+    def spawn(self, argv):
+        if argv[0] in self.missing:
+            raise FileNotFoundError(2, "No such file or directory", argv[0])
+        proc = FakeProcess(argv)
+        self.spawned.append(proc)
+        return proc
+
+    def run(self, argv, timeout):
+        if argv[0] in self.missing:
+            raise FileNotFoundError(2, "No such file or directory", argv[0])
+        self.ran.append(argv)
+        return 0
+
+    def poll(self, proc):
+        return proc.returncode
+
+    def stop(self, proc, sig, timeout):
+        proc.signals.append(sig)
+        if proc.returncode is None:
+            proc.returncode = -sig
+        return proc.returncode
+
+    def exit(self, proc, returncode):
+        proc.returncode = returncode
+
+
+class FakeHeartbeatSocket:
+    """ In place of the supervisor's heartbeat socket. """
+
+    def __init__(self):
+        self.datagrams = []
+
+    def setblocking(self, flag):
+        pass
+
+    def send_beat(self, msg=b"wall"):
+        self.datagrams.append(msg)
+
+    def recv(self, bufsize):
+        if not self.datagrams:
+            raise BlockingIOError()
+        return self.datagrams.pop(0)[:bufsize]
+
+
+class FakeBluezHCI:
+    """ In place of hci_control.BluezHCI. Commands succeed unless their
+    name is in fail. """
+
+    def __init__(self, dev_id=0, fail=()):
+        self.dev_id = dev_id
+        self.fail = set(fail)
+        self.calls = []     # (name, args) of the scan commands
+        self.resets = []
+        self.open = []      # device descriptors open now
+
+    def result(self, name):
+        return -1 if name in self.fail else 0
+
+    def get_route(self):
+        return self.dev_id
+
+    def open_dev(self, dev_id):
+        if "open_dev" in self.fail:
+            raise Exception("Can't open hci%d" % dev_id)
+        dd = 100 + len(self.open)
+        self.open.append(dd)
+        return dd
+
+    def close_dev(self, dd):
+        self.open.remove(dd)
+
+    def set_scan_parameters(self, fd, interval, window, timeout=1000):
+        self.calls.append(("set_scan_parameters", (interval, window)))
+        return self.result("set_scan_parameters")
+
+    def set_scan_enable(self, fd, enable, filter_dup, timeout=1000):
+        self.calls.append(("set_scan_enable", (enable, filter_dup)))
+        return self.result("set_scan_enable")
+
+    def reset(self, dev_id):
+        self.resets.append(dev_id)
+        if "reset" in self.fail:
+            raise Exception("Can't open hci%d" % dev_id)
+
+
+class FakeDeviceManager:
+    """ In place of gatt.DeviceManager for a wall_audit.ScoreAuditor.
+    Pass its make_device as the auditor's make_device; the devices it
+    made are in devices, by address. """
+
+    def __init__(self):
+        self.devices = {}
+        self.discovering = False
+        self.running = False
+
+    def start_discovery(self):
+        self.discovering = True
+
+    def run(self):
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+    def make_device(self, mac_address, manager, auditor, badge_id):
+        device = FakeAuditDevice(mac_address, manager, auditor, badge_id)
+        self.devices[mac_address] = device
+        return device
+
+
+class FakeAuditDevice:
+    """ In place of wall_gatt.AuditDevice. Connecting just records it;
+    read() and fail() report back to the auditor as the real device's
+    GATT callbacks would. """
+
+    def __init__(self, mac_address, manager, auditor, badge_id):
+        self.mac_address = mac_address
+        self.manager = manager
+        self.auditor = auditor
+        self.badge_id = badge_id
+        self.connects = 0
+        self.disconnects = 0
+
+    def connect(self):
+        self.connects += 1
+
+    def disconnect(self):
+        self.disconnects += 1
+
+    def read(self, score, lld=0, device_id=None):
+        """ The score characteristic decrypted to this. """
+        if device_id is None:
+            device_id = self.badge_id
+        self.auditor.result(self.mac_address, (device_id, score, lld))
+        self.disconnect()
+
+    def garbled(self):
+        """ The score characteristic didn't decrypt. """
+        self.auditor.result(self.mac_address, None)
+        self.disconnect()
+
+    def fail(self, reason="connection failed"):
+        self.auditor.failed(self.mac_address, reason)
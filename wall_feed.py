@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# The board, for viewers other than the Wall's screen.
+#
+# BoardFeed serves the board on localhost:9996 as lines of JSON. A client
+# that connects gets a snapshot of every row, then a delta at most once a
+# second with just the rows that changed, the badges that went away and
+# any names not heard before (or not for a long time):
+#
+#   {"type": "snapshot", "seq": 41, "rows": {addr: row, ...}}
+#   {"type": "delta", "seq": 42, "rows": {addr: row, ...}, "removed": [addr, ...], "names": [...]}
+#
+# where a row is {"id", "name", "score", "flag", "seen"}, seen being the
+# wall clock time the badge was last heard, to the nearest 30 seconds.
+# Each message's seq is one more than the last, so a client that sees a
+# gap has missed something; it sends the line "snapshot" and gets a new
+# snapshot to carry on from.
+#
+# Each delta is encoded once and the same bytes are queued to every
+# client, and a snapshot is only encoded when someone asks for one, so
+# the Wall does the same work however many viewers there are. Clients too
+# slow to keep up are disconnected; they can reconnect for a snapshot.
+#
+# Run this file to watch the feed:
+#
+#   ./wall_feed.py
+
+import sys
+import json
+import selectors
+import threading
+from collections import (deque, OrderedDict)
+from socket import (socket, socketpair, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR)
+
+import wall_metrics
+
+feed_addr = ("localhost", 9996)
+feed_interval = 1000        # ms between deltas, at most
+feed_max_buffer = 1 << 20   # bytes queued to one client before it's dropped
+seen_resolution = 30        # seconds; finer would put every badge heard in every delta
+feed_names_remembered = 10000   # names that won't be announced again until forgotten
+
+metrics = wall_metrics.registry
+m_feed_messages = {kind: metrics.counter("wall_feed_messages_total", "board feed messages encoded", {"type": kind})
+                   for kind in ("snapshot", "delta")}
+m_feed_bytes = metrics.counter("wall_feed_bytes_total", "board feed bytes encoded")
+m_feed_dropped = metrics.counter("wall_feed_dropped_total", "board feed clients disconnected for falling behind")
+
+
+def encode(message):
+    data = (json.dumps(message, separators=(",", ":")) + "\n").encode("utf-8")
+    m_feed_messages[message["type"]].inc()
+    m_feed_bytes.inc(len(data))
+    return data
+
+
+class FeedClient:
+    def __init__(self, sock):
+        self.sock = sock
+        self.out = bytearray()
+        self.synced = False     # has had a snapshot to apply deltas to
+        self.inbuf = b""
+
+
+class BoardFeed (threading.Thread):
+    def __init__(self, addr=feed_addr, max_buffer=feed_max_buffer):
+        threading.Thread.__init__(self, name="feed", daemon=True)
+        self.max_buffer = max_buffer
+        self.rows = {}          # address -> row, as last published
+        self.names = OrderedDict()  # names announced, least recently seen first
+        self.seq = 0
+        self.outbox = deque()   # (kind, data) from publish() for the feed thread
+        self.snapshot_requests = 0  # counted up by the feed thread
+        self.snapshots_made = 0     # requests dealt with by publish()
+        self.clients = {}
+        self.selector = selectors.DefaultSelector()
+        self.sock = socket(AF_INET, SOCK_STREAM)
+        self.sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        self.sock.bind(addr)
+        self.sock.listen(5)
+        self.sock.setblocking(False)
+        self.wake_r, self.wake_w = socketpair()
+        self.wake_r.setblocking(False)
+        self.wake_w.setblocking(False)
+        self.selector.register(self.sock, selectors.EVENT_READ, "accept")
+        self.selector.register(self.wake_r, selectors.EVENT_READ, "wake")
+        metrics.gauge("wall_feed_clients", "board feed clients connected", func=lambda: len(self.clients))
+
+    # Called from the Tk thread
+
+    def publish(self, rows):
+        """ rows is {address: row} for the whole board as it is now. Work
+        out what's changed since last time and queue it for the clients. """
+        changed = {}
+        for addr, row in rows.items():
+            if self.rows.get(addr) != row:
+                changed[addr] = row
+        removed = [addr for addr in self.rows if addr not in rows]
+        names = []
+        for row in changed.values():
+            name = row["name"]
+            if name in self.names:
+                self.names.move_to_end(name)
+            else:
+                self.names[name] = True
+                names.append(name)
+                if len(self.names) > feed_names_remembered:
+                    self.names.popitem(last=False)
+        self.rows = rows
+
+        queued = False
+        if changed or removed:
+            self.seq += 1
+            self.outbox.append(("delta", encode({"type": "delta", "seq": self.seq, "rows": changed,
+                                                 "removed": removed, "names": names})))
+            queued = True
+        requests = self.snapshot_requests
+        if requests != self.snapshots_made:
+            # One snapshot does for everyone who's asked since the last
+            self.snapshots_made = requests
+            self.outbox.append(("snapshot", encode({"type": "snapshot", "seq": self.seq, "rows": rows})))
+            queued = True
+        if queued:
+            try:
+                self.wake_w.send(b"x")
+            except OSError:
+                pass    # already awake
+
+    # The feed thread
+
+    def run(self):
+        while True:
+            for key, events in self.selector.select():
+                if key.data == "accept":
+                    self.accept()
+                elif key.data == "wake":
+                    self.deliver()
+                else:
+                    # Dropped already, by something earlier in this batch
+                    if key.data.sock is None:
+                        continue
+                    if events & selectors.EVENT_READ:
+                        self.receive(key.data)
+                    if events & selectors.EVENT_WRITE and key.data.sock is not None:
+                        self.flush(key.data)
+
+    def accept(self):
+        try:
+            conn, address = self.sock.accept()
+        except OSError:
+            return
+        conn.setblocking(False)
+        client = FeedClient(conn)
+        self.clients[conn] = client
+        self.selector.register(conn, selectors.EVENT_READ, client)
+        self.snapshot_requests += 1
+
+    def deliver(self):
+        try:
+            while self.wake_r.recv(4096):
+                pass
+        except OSError:
+            pass
+        while self.outbox:
+            kind, data = self.outbox.popleft()
+            for client in list(self.clients.values()):
+                if kind == "delta" and client.synced:
+                    self.queue(client, data)
+                elif kind == "snapshot" and not client.synced:
+                    client.synced = True
+                    self.queue(client, data)
+
+    def queue(self, client, data):
+        if len(client.out) + len(data) > self.max_buffer:
+            m_feed_dropped.inc()
+            self.drop(client)
+            return
+        was_empty = not client.out
+        client.out += data
+        if was_empty:
+            self.flush(client)
+
+    def flush(self, client):
+        try:
+            sent = client.sock.send(client.out)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.drop(client)
+            return
+        del client.out[:sent]
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.out else 0)
+        self.selector.modify(client.sock, events, client)
+
+    def receive(self, client):
+        try:
+            data = client.sock.recv(1024)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.drop(client)
+            return
+        client.inbuf += data
+        while b"\n" in client.inbuf:
+            line, client.inbuf = client.inbuf.split(b"\n", 1)
+            if line.strip() == b"snapshot":
+                client.synced = False
+                self.snapshot_requests += 1
+        client.inbuf = client.inbuf[-1024:]
+
+    def drop(self, client):
+        if client.sock is None:
+            return
+        self.selector.unregister(client.sock)
+        del self.clients[client.sock]
+        client.sock.close()
+        client.sock = None
+
+
+class FeedViewer:
+    """ Keeps a copy of the board from the feed's messages. apply()
+    returns False if a message was missed and a snapshot is needed. """
+
+    def __init__(self):
+        self.rows = {}
+        self.seq = None
+
+    def apply(self, message):
+        if message["type"] == "snapshot":
+            self.rows = dict(message["rows"])
+            self.seq = message["seq"]
+            return True
+        if self.seq is None:
+            return False
+        if message["seq"] != self.seq + 1:
+            self.seq = None
+            return False
+        self.rows.update(message["rows"])
+        for addr in message["removed"]:
+            self.rows.pop(addr, None)
+        self.seq = message["seq"]
+        return True
+
+
+def main():
+    sock = socket(AF_INET, SOCK_STREAM)
+    sock.connect(feed_addr)
+    viewer = FeedViewer()
+    for line in sock.makefile("rb"):
+        message = json.loads(line)
+        if not viewer.apply(message):
+            sock.sendall(b"snapshot\n")
+            continue
+        print("\nseq %d, %d badges" % (viewer.seq, len(viewer.rows)))
+        for row in sorted(viewer.rows.values(), key=lambda row: row["score"], reverse=True)[:20]:
+            print("%s %s %-8s %6d" % (row["flag"], row["id"], row["name"], row["score"]))
+        for name in message.get("names", ()):
+            print("new name: %s" % name)
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
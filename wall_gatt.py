@@ -0,0 +1,111 @@
+# GATT access to badges from within the Wall.
+#
+# Kept out of walloftio.py because importing gatt pulls in dbus and GLib,
+# which is slow on the Pi Zero and not needed unless we actually connect.
+
+import threading
+
+import gatt
+from gi.repository import GLib
+import joco_crypto
+
+
+class BadgeDevice(gatt.Device):
+    def __init__(self, mac_address, manager, logtext=print):
+        super().__init__(mac_address=mac_address, manager=manager)
+        self.logtext = logtext
+
+    def connect_succeeded(self):
+        super().connect_succeeded()
+        self.logtext("Connected")
+
+    def connect_failed(self, error):
+        super().connect_failed(error)
+        self.logtext("Failed")
+
+    def disconnect_succeeded(self):
+        super().disconnect_succeeded()
+        self.logtext("Disconnected")
+
+    def services_resolved(self):
+        super().services_resolved()
+        score_service = next(
+            s for s in self.services
+            if s.uuid == '0000bd7e-0000-1000-8000-00805f9b34fb')
+        encrypted_score = next(
+            c for c in score_service.characteristics
+            if c.uuid == '00002e15-0000-1000-8000-00805f9b34fb')
+        encrypted_score.read_value()
+        self.logtext("Reading")
+
+    def characteristic_value_update(self, characteristic, value):
+        result = joco_crypto.eval_score_characteristic(value)
+        if result is None:
+            self.logtext("Invalid")
+        else:
+            self.logtext("%s %d %d" % result)
+        self.disconnect()
+        self.manager.stop()
+
+    def characteristic_read_value_failed(self, characteristic, error):
+        self.logtext("Read failed.")
+
+
+SCORE_SERVICE = '0000bd7e-0000-1000-8000-00805f9b34fb'
+SCORE_CHARACTERISTIC = '00002e15-0000-1000-8000-00805f9b34fb'
+
+
+class AuditDevice(gatt.Device):
+    """ Reads a badge's encrypted score for a wall_audit.ScoreAuditor,
+    with a cipher of its own so several can be read at once. """
+
+    def __init__(self, mac_address, manager, auditor, badge_id):
+        super().__init__(mac_address=mac_address, manager=manager)
+        self.auditor = auditor
+        # The device ID as shown on the board is the two key bytes in order
+        self.cipher = joco_crypto.make_cipher(bytes.fromhex(badge_id))
+        self.done = False
+
+    def report(self, result=None, failure=None):
+        if self.done:
+            return
+        self.done = True
+        if failure is not None:
+            self.auditor.failed(self.mac_address, failure)
+        else:
+            self.auditor.result(self.mac_address, result)
+        self.disconnect()
+
+    def connect_failed(self, error):
+        super().connect_failed(error)
+        self.report(failure="connection failed: %s" % error)
+
+    def disconnect_succeeded(self):
+        super().disconnect_succeeded()
+        self.report(failure="disconnected")
+
+    def services_resolved(self):
+        super().services_resolved()
+        try:
+            score_service = next(s for s in self.services if s.uuid == SCORE_SERVICE)
+            encrypted_score = next(c for c in score_service.characteristics if c.uuid == SCORE_CHARACTERISTIC)
+        except StopIteration:
+            self.report(result=None)    # not a badge that keeps score
+            return
+        encrypted_score.read_value()
+
+    def characteristic_value_updated(self, characteristic, value):
+        self.report(result=joco_crypto.eval_score_characteristic(bytes(value), self.cipher))
+
+    def characteristic_read_value_failed(self, characteristic, error):
+        self.report(failure="read failed: %s" % error)
+
+
+def start_auditor(auditor, tick_seconds=1):
+    """ Run the auditor's DeviceManager main loop in a thread of its own,
+    ticking the auditor on it. """
+    GLib.timeout_add_seconds(tick_seconds, auditor.tick)
+    auditor.manager.start_discovery()     # BlueZ can only connect to devices it has seen
+    thread = threading.Thread(target=auditor.manager.run, name="audit", daemon=True)
+    thread.start()
+    return thread
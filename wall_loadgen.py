@@ -0,0 +1,205 @@
+# Synthetic badge advertisements, for stress testing the Wall without a
+# roomful of badges.
+#
+# LoadGenerator makes valid HCI LE Advertising Report events for a crowd
+# of synthetic badges of every type badgeParse understands, plus noise from
+# devices that aren't badges. Scores drift upwards and names change now and
+# then. FakeHCISocket hands those frames out like the Wall's raw HCI socket,
+# so it can stand in for it:
+#
+#   ./walloftio.py --synthetic 200 --synthetic-rate 500
+
+import time
+import struct
+import random
+import socket
+
+from badge_parse import (
+    BADGE_TYPE_TRANSIO,
+    BADGE_TYPE_TRANSIO_TMP,
+    BADGE_TYPE_JOCO,
+    BADGE_TYPE_ANDNXOR,
+    EVT_LE_ADVERTISING_REPORT,
+    EVT_LE_EXT_ADVERTISING_REPORT,
+)
+
+SOL_HCI = getattr(socket, "SOL_HCI", 0)    # so it works where Python lacks Bluetooth
+HCI_CMSG_TSTAMP = 0x0002
+BADGE_TYPE_OTHER = 0x004c   # anything else shows up as "????"; this is Apple
+
+LAYOUTS = (BADGE_TYPE_TRANSIO, BADGE_TYPE_TRANSIO_TMP, BADGE_TYPE_JOCO,
+           BADGE_TYPE_ANDNXOR, BADGE_TYPE_OTHER)
+
+NAME_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+
+
+def random_name(rng):
+    return "".join(rng.choice(NAME_CHARS) for i in range(rng.randint(3, 8)))
+
+
+def random_address(rng):
+    # Static random address: top two bits set. Most significant byte first.
+    return bytes([0xc0 | rng.randrange(64)] + [rng.randrange(256) for i in range(5)])
+
+
+def ad_structure(kind, payload):
+    return bytes([len(payload) + 1, kind]) + bytes(payload)
+
+
+class SyntheticBadge:
+    def __init__(self, rng, badge_type):
+        self.rng = rng
+        self.type = badge_type
+        self.address = random_address(rng)
+        self.ident = rng.randrange(0x10000)
+        self.name = random_name(rng)
+        self.dc26 = rng.random() < 0.5
+        self.score = rng.randrange(1000)
+        self.trinket = 0
+
+    def ad_data(self):
+        t = self.type
+        lo, hi = self.ident & 0xff, self.ident >> 8
+        if t in (BADGE_TYPE_JOCO, BADGE_TYPE_TRANSIO_TMP):
+            value = (self.score & 0x7fff) | (0x8000 if self.trinket else 0)
+            mfr = [t & 0xff, t >> 8, lo, hi, value >> 8, value & 0xff]
+        elif t == BADGE_TYPE_TRANSIO:
+            mfr = [t & 0xff, t >> 8, 0, lo, hi, 0, (self.score >> 8) & 0xff, self.score & 0xff]
+        elif t == BADGE_TYPE_ANDNXOR:
+            mfr = [t & 0xff, t >> 8] + ([0] if self.dc26 else []) + [lo, hi, 0, 0]
+        else:
+            mfr = [t & 0xff, t >> 8, 0x10, 0x05, 0x01, 0x18]
+        return (ad_structure(0x01, [0x06]) +
+                ad_structure(0x09, self.name.encode("utf-8")) +
+                ad_structure(0x19, [0xdc, 0x26 if self.dc26 else 0x19]) +
+                ad_structure(0xff, mfr))
+
+    def drift(self, score_drift, name_churn):
+        if self.rng.random() < score_drift:
+            self.score = min(0x7fff, self.score + self.rng.randint(1, 25))
+        if self.rng.random() < name_churn:
+            self.name = random_name(self.rng)
+        if self.type in (BADGE_TYPE_JOCO, BADGE_TYPE_TRANSIO_TMP):
+            self.trinket = 1 if self.score >= 2000 else 0
+
+
+class NoiseDevice:
+    """ Something that isn't a badge: no name, or no manufacturer data. """
+
+    def __init__(self, rng):
+        self.address = random_address(rng)
+        if rng.random() < 0.5:
+            self.data = ad_structure(0x01, [0x1a]) + ad_structure(0xff, [0x4c, 0x00, 0x10, 0x05, 0x0b, 0x1c])
+        else:
+            self.data = ad_structure(0x01, [0x06]) + ad_structure(0x09, random_name(rng).encode("utf-8"))
+
+    def ad_data(self):
+        return self.data
+
+    def drift(self, score_drift, name_churn):
+        pass
+
+
+def legacy_report(address, ad_data, rssi):
+    return (bytes([0x00, 0x01]) + address[::-1] + bytes([len(ad_data)]) +
+            ad_data + bytes([rssi & 0xff]))
+
+
+def extended_report(address, ad_data, rssi):
+    return (bytes([0x13, 0x00, 0x01]) + address[::-1] +
+            bytes([0x01, 0x00, 0xff, 0x7f, rssi & 0xff, 0x00, 0x00, 0x00]) + bytes(6) +
+            bytes([len(ad_data)]) + ad_data)
+
+
+def event(subevent, reports):
+    params = bytes([subevent, len(reports)]) + b"".join(reports)
+    return bytes([0x04, 0x3e, len(params)]) + params
+
+
+class LoadGenerator:
+    def __init__(self, badges=100, noise=20, rate=200.0, score_drift=0.05,
+                 name_churn=0.001, batch=1, extended=0.0, layouts=LAYOUTS, seed=None):
+        """ badges and noise are how many of each device there are; rate is
+        advertisements per second; score_drift and name_churn are the chance
+        per advertisement that a badge's score goes up or its name changes;
+        batch is the most reports packed into one event; extended is the
+        fraction of events sent as LE Extended Advertising Reports."""
+
+        self.rng = random.Random(seed)
+        self.devices = ([SyntheticBadge(self.rng, layouts[i % len(layouts)]) for i in range(badges)] +
+                        [NoiseDevice(self.rng) for i in range(noise)])
+        self.rate = rate
+        self.score_drift = score_drift
+        self.name_churn = name_churn
+        self.batch = batch
+        self.extended = extended
+        self.adverts = 0
+
+    def next_frame(self):
+        rng = self.rng
+        count = rng.randint(1, self.batch)
+        if rng.random() < self.extended:
+            subevent, make_report = EVT_LE_EXT_ADVERTISING_REPORT, extended_report
+        else:
+            subevent, make_report = EVT_LE_ADVERTISING_REPORT, legacy_report
+        reports = []
+        size = 2
+        for i in range(count):
+            device = rng.choice(self.devices)
+            device.drift(self.score_drift, self.name_churn)
+            report = make_report(device.address, device.ad_data(), rng.randint(-95, -30))
+            if size + len(report) > 255:
+                break
+            reports.append(report)
+            size += len(report)
+        self.adverts += len(reports)
+        return event(subevent, reports)
+
+    def frames(self, count):
+        return [self.next_frame() for i in range(count)]
+
+
+class FakeHCISocket:
+    """ Enough of a raw HCI socket for BTAdapter, serving frames from a
+    LoadGenerator. In realtime mode frames are paced at the generator's
+    rate; otherwise they come as fast as they're read. After limit frames
+    it goes quiet, like an empty hall."""
+
+    def __init__(self, generator, realtime=True, limit=None):
+        self.generator = generator
+        self.realtime = realtime
+        self.limit = limit
+        self.sent = 0
+        self.due = time.monotonic()
+        self.closed = False
+
+    def next_frame(self):
+        while self.limit is not None and self.sent >= self.limit and not self.closed:
+            time.sleep(0.1)
+        if self.closed:
+            raise OSError("socket closed")
+        if self.realtime:
+            delay = self.due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.due = max(self.due, time.monotonic() - 1.0) + 1.0 / self.generator.rate
+        self.sent += 1
+        return self.generator.next_frame()
+
+    def recv(self, bufsize):
+        return self.next_frame()[:bufsize]
+
+    def recvmsg(self, bufsize, ancbufsize=0):
+        data = self.next_frame()[:bufsize]
+        now = time.time()
+        stamp = struct.pack("@ll", int(now), int((now % 1) * 1000000))
+        return (data, [(SOL_HCI, HCI_CMSG_TSTAMP, stamp)], 0, None)
+
+    def fileno(self):
+        return -1
+
+    def setsockopt(self, *args):
+        pass
+
+    def close(self):
+        self.closed = True
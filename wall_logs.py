@@ -0,0 +1,68 @@
+# The Wall's intercept logs: writing them, and reading them back.
+#
+# Each log file is named for the UTC time it was written, like
+# 20180518143000.log, and holds one intercept per line: the receive
+# time in seconds since the epoch, a space, and the raw HCI frame in hex.
+
+import os
+import glob
+import time
+
+import wall_metrics
+
+metrics = wall_metrics.registry
+m_logged = metrics.counter("wall_logged_total", "intercepts written to log files")
+m_log_writeout = metrics.histogram("wall_log_writeout_seconds", "time to write a log file")
+
+
+class Logger:
+    """ Collects intercepts and writes them out 1000 at a time. """
+
+    def __init__(self, directory="."):
+        self.directory = directory
+        self.intercepts = []
+        self.count = 0
+
+    def _writeout(self):
+        start = time.perf_counter()
+        filename = os.path.join(self.directory,
+                                time.strftime("%Y%m%d%H%M%S", time.gmtime(time.time())) + ".log")
+        with open(filename, "a") as f:     # another file may have been written this second
+            for ts, data, mono in self.intercepts:
+                hex = ''.join('{0:02x}'.format(x) for x in data)
+                print("%f %s" % (ts, hex), file=f)
+        m_logged.inc(len(self.intercepts))
+        m_log_writeout.observe(time.perf_counter() - start)
+
+    def intercept(self, cept):
+        self.intercepts.append(cept)
+        self.count += 1
+        if self.count >= 1000:
+            self._writeout()
+            self.intercepts = []
+            self.count = 0
+
+    def closeout(self):
+        self._writeout()
+
+
+def read_log(filename):
+    """ Yield (timestamp, data) for each intercept in a log file. """
+    with open(filename) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 2:
+                continue
+            yield (float(fields[0]), bytes.fromhex(fields[1]))
+
+
+def log_files(paths):
+    """ Expand a list of log files and directories of log files into a
+    list of log files, in the order they were written. """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(glob.glob(os.path.join(path, "*.log")))
+        else:
+            files.append(path)
+    return sorted(files, key=os.path.basename)
@@ -0,0 +1,201 @@
+# Counters, gauges and histograms for watching the Wall while it runs.
+#
+# Metrics live in a registry and can be read out in the Prometheus text
+# format, either directly with render() or from a MetricsServer on a
+# localhost port:
+#
+#     curl http://localhost:9997/
+#
+# Updating a metric is just arithmetic on a Python number, so they're
+# cheap enough to use in the capture and display paths.
+#
+# A gauge's func is called when the metrics are read, which for the
+# MetricsServer is on its own thread, not the Tk thread. So a func must
+# only read something another thread can't be changing under it: a number
+# kept up to date by the thread that owns the data, not a walk over a dict
+# or set that thread is adding to.
+
+import bisect
+import threading
+from socket import (socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR)
+
+# With this address set to localhost, the metrics are not visible
+# to hosts on the network, just from the local machine.
+metrics_addr = ("localhost", 9997)
+
+# Default histogram buckets, in seconds
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def format_labels(labels, extra=None):
+    items = list(labels)
+    if extra is not None:
+        items.append(extra)
+    if not items:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, v) for k, v in items) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, labels, func=None):
+        self.labels = labels
+        self.value = 0
+        self.func = func    # if given, called for a count kept elsewhere, at read time
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get(self):
+        if self.func is not None:
+            return self.func()
+        return self.value
+
+    def samples(self, name):
+        yield name, format_labels(self.labels), self.get()
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, labels, func=None):
+        self.labels = labels
+        self.value = 0
+        self.func = func    # if given, called for the value at read time, on the reader's thread
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        if self.func is not None:
+            return self.func()
+        return self.value
+
+    def samples(self, name):
+        yield name, format_labels(self.labels), self.get()
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, labels, buckets=TIME_BUCKETS):
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.sum / self.count
+
+    def samples(self, name):
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += n
+            yield (name + "_bucket",
+                   format_labels(self.labels, ("le", format_value(bound))),
+                   cumulative)
+        yield name + "_sum", format_labels(self.labels), self.sum
+        yield name + "_count", format_labels(self.labels), self.count
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}   # name -> (kind, help, {labels: metric})
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        key = tuple(sorted(labels.items())) if labels else ()
+        family = self.metrics.get(name)
+        if family is None or key not in family[2]:
+            with self.lock:
+                family = self.metrics.setdefault(name, (cls.kind, help, {}))
+                if family[0] != cls.kind:
+                    raise ValueError("%s is already a %s" % (name, family[0]))
+                if key not in family[2]:
+                    family[2][key] = cls(key, **kwargs)
+        return family[2][key]
+
+    def counter(self, name, help="", labels=None, func=None):
+        return self._get(Counter, name, help, labels, func=func)
+
+    def gauge(self, name, help="", labels=None, func=None):
+        return self._get(Gauge, name, help, labels, func=func)
+
+    def histogram(self, name, help="", labels=None, buckets=TIME_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            families = sorted((name, kind, help, list(members.values()))
+                              for name, (kind, help, members) in self.metrics.items())
+        for name, kind, help, members in families:
+            if help:
+                lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for metric in members:
+                for sample, labels, value in metric.samples(name):
+                    lines.append("%s%s %s" % (sample, labels, format_value(value)))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer (threading.Thread):
+    """ Serves the registry to anything that connects to addr. Speaks just
+    enough HTTP for curl or a Prometheus scraper; nc works too."""
+
+    def __init__(self, registry, addr=metrics_addr):
+        threading.Thread.__init__(self, daemon=True)
+        self.registry = registry
+        self.sock = socket(AF_INET, SOCK_STREAM)
+        self.sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+        self.sock.bind(addr)
+        self.sock.listen(5)
+
+    def run(self):
+        while True:
+            conn, address = self.sock.accept()
+            try:
+                conn.settimeout(1.0)
+                try:
+                    conn.recv(1024)     # request, if any; contents don't matter
+                except OSError:
+                    pass
+                try:
+                    body = self.registry.render().encode("utf-8")
+                    status = b"200 OK"
+                except Exception as e:
+                    # One bad gauge func shouldn't stop the metrics for good
+                    print("Metrics render failed: %r" % e, flush=True)
+                    body = ("render failed: %r\n" % e).encode("utf-8")
+                    status = b"500 Internal Server Error"
+                conn.sendall(b"HTTP/1.0 " + status + b"\r\n"
+                             b"Content-Type: text/plain; version=0.0.4\r\n"
+                             b"Content-Length: %d\r\n\r\n" % len(body) + body)
+            except OSError:
+                pass
+            finally:
+                conn.close()
+
+
+registry = Registry()
@@ -0,0 +1,126 @@
+# Profiling the Wall while it runs, without restarting it.
+#
+#   kill -USR1 <pid>   start profiling; send it again to stop and write
+#                      <time>-profile.collapsed  sampled stacks of every thread,
+#                                                one "frame;frame;... count" per line,
+#                                                ready for flamegraph.pl
+#                      <time>-profile.prof       cProfile stats for the Tk thread,
+#                                                read with python3 -m pstats
+#   kill -USR2 <pid>   take a tracemalloc snapshot; the first one starts
+#                      tracing, each later one writes <time>-memory.diff with
+#                      the biggest changes since the previous snapshot
+#
+# Files go in the same directory as the intercept logs.
+#
+# cProfile only sees the thread that enables it. The signal handlers run in
+# the main (Tk) thread, so that's the one it profiles. The capture thread
+# and the others are covered by the stack sampler.
+
+import os
+import sys
+import time
+import threading
+
+sample_interval = 0.005     # seconds between stack samples
+memory_traceback_depth = 10
+memory_diff_lines = 50
+
+
+def timestamp():
+    return time.strftime("%Y%m%d%H%M%S", time.gmtime(time.time()))
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class StackSampler (threading.Thread):
+    def __init__(self, interval=sample_interval):
+        threading.Thread.__init__(self, name="profiler", daemon=True)
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.stacks = {}
+        self.samples = 0
+
+    def run(self):
+        me = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ";".join(reversed(stack))
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+    def write(self, filename):
+        with open(filename, "w") as f:
+            for stack, count in sorted(self.stacks.items()):
+                print("%s %d" % (stack, count), file=f)
+
+
+class WallProfiler:
+    def __init__(self, directory="."):
+        self.directory = directory
+        self.sampler = None
+        self.profile = None
+        self.snapshot = None
+
+    def path(self, suffix):
+        return os.path.join(self.directory, timestamp() + suffix)
+
+    def running(self):
+        return self.sampler is not None
+
+    def start(self):
+        import cProfile
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        self.sampler = StackSampler()
+        self.sampler.start()
+        print("Profiling started", flush=True)
+
+    def stop(self):
+        self.profile.disable()
+        self.sampler.stop()
+        collapsed = self.path("-profile.collapsed")
+        self.sampler.write(collapsed)
+        self.profile.dump_stats(self.path("-profile.prof"))
+        print("Profiling stopped after %d samples, wrote %s" % (self.sampler.samples, collapsed),
+              flush=True)
+        self.sampler = None
+        self.profile = None
+
+    def toggle(self, signum=None, frame=None):
+        if self.running():
+            self.stop()
+        else:
+            self.start()
+
+    def memory_snapshot(self, signum=None, frame=None):
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(memory_traceback_depth)
+            self.snapshot = tracemalloc.take_snapshot()
+            print("Memory tracing started", flush=True)
+            return
+
+        snapshot = tracemalloc.take_snapshot()
+        filename = self.path("-memory.diff")
+        current, peak = tracemalloc.get_traced_memory()
+        with open(filename, "w") as f:
+            print("traced now %d bytes, peak %d bytes" % (current, peak), file=f)
+            for stat in snapshot.compare_to(self.snapshot, "lineno")[:memory_diff_lines]:
+                print(stat, file=f)
+        self.snapshot = snapshot
+        print("Wrote %s" % filename, flush=True)
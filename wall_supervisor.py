@@ -0,0 +1,251 @@
+#!./capython3
+# Keeps the Wall and the trinket station running.
+#
+# Replaces the old runwoj2.sh loop. Each component runs as a child process.
+# The Wall sends a heartbeat datagram to localhost:9998 as it processes
+# intercepts while its capture thread is alive; if they stop or a child
+# exits, only that child is stopped and restarted. For the Wall of JoCo,
+# which sends no heartbeats, run with --wall ./wallofjoco.py --no-heartbeat
+# and it's only restarted when it exits. The HCI adapter is
+# reset before the Wall is relaunched, so there's no need to bounce it
+# by hand or reboot.
+#
+# Runs under capython3 because resetting the adapter needs cap_net_admin.
+
+import time
+import signal
+import argparse
+import subprocess
+from socket import (socket, AF_INET, SOCK_DGRAM)
+
+import hci_control
+
+# Must match heartbeat_addr in walloftio.py
+heartbeat_addr = ("localhost", 9998)
+
+tick_interval = 1.0         # seconds between health checks
+stop_timeout = 5.0          # seconds to wait for a child to exit cleanly
+min_restart_delay = 1.0     # backoff for a child that keeps dying
+max_restart_delay = 60.0
+stable_time = 120.0         # healthy this long and the backoff resets
+
+
+class ProcessControl:
+    """ Starts and stops child processes. Replace with a fake for testing. """
+
+    def spawn(self, argv):
+        return subprocess.Popen(argv)
+
+    def run(self, argv, timeout):
+        try:
+            return subprocess.call(argv, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return None
+
+    def poll(self, proc):
+        return proc.poll()
+
+    def stop(self, proc, sig, timeout):
+        if proc.poll() is not None:
+            return proc.returncode
+        proc.send_signal(sig)
+        try:
+            return proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            return proc.wait()
+
+
+class Component:
+    def __init__(self, name, argv, heartbeat_timeout=None, startup_grace=30.0,
+                 needs_adapter=False, prestart=None, stop_signal=signal.SIGINT):
+        self.name = name
+        self.argv = argv
+        self.heartbeat_timeout = heartbeat_timeout  # None: only watch for exit
+        self.startup_grace = startup_grace      # time allowed for first heartbeat
+        self.needs_adapter = needs_adapter      # reset HCI before (re)starting
+        self.prestart = prestart                # command to run before starting
+        self.stop_signal = stop_signal
+
+        self.proc = None
+        self.started_at = None
+        self.last_beat = None
+        self.failed_at = None       # set while a restart is in progress
+        self.restart_delay = min_restart_delay
+        self.next_start = 0.0
+
+        # restart metrics
+        self.restarts = 0
+        self.restart_times = []
+        self.failures = {}
+
+    def healthy(self):
+        return self.proc is not None and self.failed_at is None
+
+    def metrics(self):
+        times = self.restart_times
+        return {"restarts": self.restarts,
+                "failures": dict(self.failures),
+                "last_restart": times[-1] if times else None,
+                "mean_restart": sum(times) / len(times) if times else None,
+                "max_restart": max(times) if times else None}
+
+
+class Supervisor:
+    def __init__(self, components, hci=None, procs=None, dev_id=0,
+                 clock=time.monotonic, hbsock=None):
+        self.components = components
+        self.hci = hci
+        self.procs = procs if procs is not None else ProcessControl()
+        self.dev_id = dev_id
+        self.clock = clock
+        if hbsock is None:
+            hbsock = socket(AF_INET, SOCK_DGRAM)
+            hbsock.bind(heartbeat_addr)
+        hbsock.setblocking(False)
+        self.hbsock = hbsock
+        self.running = False
+
+    def reset_adapter(self):
+        if self.hci is None:
+            return
+        try:
+            self.hci.reset(self.dev_id)
+        except Exception as e:
+            print("Supervisor: adapter reset failed: %s" % e, flush=True)
+
+    def start(self, comp):
+        if comp.needs_adapter:
+            self.reset_adapter()
+        print("Supervisor: starting %s" % comp.name, flush=True)
+        comp.started_at = self.clock()
+        comp.last_beat = None
+        try:
+            if comp.prestart is not None:
+                self.procs.run(comp.prestart, timeout=30)
+            comp.proc = self.procs.spawn(comp.argv)
+        except OSError as e:
+            # A missing or unrunnable program; back off and try again
+            # like any other failure, rather than taking everything down
+            print("Supervisor: can't start %s: %s" % (comp.name, e), flush=True)
+            self.fail(comp, "spawn failed")
+            return
+        if comp.failed_at is not None and comp.heartbeat_timeout is None:
+            self.recovered(comp)
+
+    def recovered(self, comp):
+        elapsed = self.clock() - comp.failed_at
+        comp.failed_at = None
+        comp.restart_times.append(elapsed)
+        m = comp.metrics()
+        print("Supervisor: %s recovered in %.2fs (%d restarts, mean %.2fs, max %.2fs)" %
+              (comp.name, elapsed, m["restarts"], m["mean_restart"], m["max_restart"]),
+              flush=True)
+
+    def fail(self, comp, reason):
+        now = self.clock()
+        print("Supervisor: %s failed (%s)" % (comp.name, reason), flush=True)
+        comp.failures[reason] = comp.failures.get(reason, 0) + 1
+        comp.restarts += 1
+        if comp.failed_at is None:
+            comp.failed_at = now
+        if comp.proc is not None:
+            self.procs.stop(comp.proc, comp.stop_signal, stop_timeout)
+            comp.proc = None
+        # Back off if it died soon after the last start
+        if comp.started_at is not None and now - comp.started_at < stable_time:
+            comp.restart_delay = min(comp.restart_delay * 2, max_restart_delay)
+        else:
+            comp.restart_delay = min_restart_delay
+        comp.next_start = now + comp.restart_delay
+
+    def read_heartbeats(self):
+        now = self.clock()
+        while True:
+            try:
+                msg = self.hbsock.recv(64)
+            except (BlockingIOError, InterruptedError):
+                break
+            name = msg.decode("ascii", "replace").split()[0] if msg else ""
+            for comp in self.components:
+                if comp.name == name and comp.proc is not None:
+                    comp.last_beat = now
+                    if comp.failed_at is not None:
+                        self.recovered(comp)
+
+    def check(self, comp):
+        now = self.clock()
+        if comp.proc is None:
+            if now >= comp.next_start:
+                self.start(comp)
+            return
+        rc = self.procs.poll(comp.proc)
+        if rc is not None:
+            comp.proc = None        # already gone, nothing to stop
+            self.fail(comp, "exit %d" % rc)
+            return
+        if comp.heartbeat_timeout is None:
+            return
+        if comp.last_beat is None:
+            if now - comp.started_at > comp.startup_grace:
+                self.fail(comp, "no heartbeat")
+        elif now - comp.last_beat > comp.heartbeat_timeout:
+            self.fail(comp, "heartbeat lost")
+
+    def tick(self):
+        self.read_heartbeats()
+        for comp in self.components:
+            self.check(comp)
+
+    def run(self):
+        self.running = True
+        self.reset_adapter()
+        try:
+            while self.running:
+                self.tick()
+                time.sleep(tick_interval)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        for comp in self.components:
+            if comp.proc is not None:
+                print("Supervisor: stopping %s" % comp.name, flush=True)
+                self.procs.stop(comp.proc, comp.stop_signal, stop_timeout)
+                comp.proc = None
+        for comp in self.components:
+            print("Supervisor: %s %s" % (comp.name, comp.metrics()), flush=True)
+
+    def stop(self):
+        self.running = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run and watch over the Wall and trinket station.')
+    parser.add_argument('--hci', type=int, default=0, help='HCI device number the Wall scans on')
+    parser.add_argument('--no-trinket', default=False, action='store_const', const=True)
+    parser.add_argument('--wall', default='./walloftio.py', help='the Wall program to run')
+    parser.add_argument('--no-heartbeat', default=False, action='store_const', const=True,
+                        help='the Wall program sends no heartbeats, so only restart it when it exits')
+    args = parser.parse_args()
+
+    components = [Component("wall", [args.wall],
+                            heartbeat_timeout=None if args.no_heartbeat else 15.0,
+                            needs_adapter=True)]
+    if not args.no_trinket:
+        components.append(Component("trinket", ["./trinketctl.py"],
+                                    prestart=["./resetnfc.py"],
+                                    stop_signal=signal.SIGHUP))
+
+    sup = Supervisor(components, hci=hci_control.BluezHCI(), dev_id=args.hci)
+
+    def on_signal(signalnum, frame):
+        sup.stop()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+    sup.run()
+
+
+if __name__ == "__main__":
+    main()
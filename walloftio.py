@@ -7,30 +7,58 @@
 # taken from https://stackoverflow.com/questions/23788176/finding-bluetooth-low-energy-with-python
 
 
+import time
+startup_t0 = time.perf_counter()
+
 import sys
 import os
 import struct
 import signal
-import time
-import errno
-from ctypes import (CDLL, get_errno)
-from ctypes.util import find_library
+import argparse
 from socket import (
     socket,
     AF_BLUETOOTH,
     AF_INET,
     SOCK_RAW,
     SOCK_STREAM,
+    SOCK_DGRAM,
     BTPROTO_HCI,
     SOL_HCI,
     HCI_FILTER,
+    CMSG_SPACE,
 )
 from tkinter import *
-from PIL import ImageTk, Image
 from collections import deque
 import threading
-import gatt
-import random
+import wall_metrics
+import wall_profiler
+import wall_feed
+import wall_bus
+import hci_control
+from scan_control import ScanController
+from wall_logs import Logger
+from badge_store import (BadgeStore, merge_intercept)
+from badge_index import BadgeIndex
+from board_format import (board_flag, board_line)
+from score_history import ScoreHistory
+from name_tracker import NameTracker
+from presence import PresenceTracker
+from badge_parse import (
+    BADGE_TYPE_TRANSIO_TMP,
+    BADGE_TYPE_JOCO,
+    BADGE_NAME,
+    BADGE_NAMES,
+    BADGE_ID,
+    BADGE_IDS,
+    BADGE_TIME,
+    BADGE_MONO,
+    BADGE_ADDR,
+    BADGE_CTRINKET,
+    BADGE_CSCORE,
+    BADGE_TYPE,
+    ParseCache,
+    parse_failures,
+)
 
 wait_factor = 50
 
@@ -38,44 +66,100 @@ wait_factor = 50
 # to hosts on the network, just from the local machine.
 termaddr = ("localhost", 9999)
 
-BADGE_TYPE_TRANSIO = 0x064a
-BADGE_TYPE_TRANSIO_TMP = 0x0858
-BADGE_TYPE_JOCO = 0x0b25
-BADGE_TYPE_ANDNXOR = 0x049e
-
-BADGE_YEAR = "yr"     # year (Appearance field) in most recent advertisement
-BADGE_YEARS = "yrs"   # list of years seen for this address
-BADGE_NAME = "nm"     # badge name (Complete Local Name) in most recent
-BADGE_NAMES = "nms"   # list of names seen for this address
-BADGE_ID = "id"       # badge ID (first two octets of Manufacturer Specific Data)
-BADGE_IDS = "ids"     # list of badge IDs seen for this address
-BADGE_TIME = "tm"     # time of most recent advertisement received
-BADGE_ADDR = "ad"     # Advertising Address for this badge (assumed constant)
-BADGE_CNT = "n"       # number of advertisements received from this address
-BADGE_ID_FAKED = "faked"    # present if multiple IDs seen for this address
-BADGE_CTRINKET = "tkt"    # claimed to deserve a trinket
-BADGE_CSCORE = "csc"  # claimed current score
-BADGE_TYPE = "ty"     # Badge type (Company ID)
+# Heartbeats for wall_supervisor.py go here. Sent from the Tk loop, and
+# only while the capture thread is alive, so a hang in either one stops them.
+heartbeat_addr = ("localhost", 9998)
+heartbeat_interval = 5000     # milliseconds
+shutdown_wait = 2.0           # seconds for the capture thread to turn off the scan
+
+# Have the kernel timestamp each HCI frame as it arrives, rather than
+# reading the clock after Python gets around to receiving it.
+kernel_timestamps = True
+HCI_TIME_STAMP = 3          # socket option, from <bluetooth/hci.h>
+HCI_CMSG_TSTAMP = 0x0002    # ancillary data type of the timestamp
 
 MAIN_DISPLAY_FONTSIZE = 40
 
+render_fps = 10     # most redraws per second for the fast-changing displays
+
+photo_file = "walloftio.png"
+
+score_history_file = "scores.hist"
+score_export_interval = 10 * 60 * 1000     # milliseconds
+
+names_common = 30       # most common names shown
+names_trending = 10     # then this many trending names
+names_update_interval = 10 * 1000   # milliseconds
+
+metrics = wall_metrics.registry
+m_frames = metrics.counter("wall_frames_total", "HCI frames received")
+m_queue_drops = metrics.counter("wall_queue_drops_total", "frames dropped because btQueue was full")
+m_intercepts = metrics.counter("wall_intercepts_total", "badge advertisements processed")
+m_parse_time = metrics.histogram("wall_parse_seconds", "time to parse a frame, parse cache included")
+m_process_time = metrics.histogram("wall_process_seconds", "time in processAdvertisement")
+m_frames_rendered = metrics.counter("wall_frames_rendered_total", "coalesced redraws of the live and terminal displays")
+m_display_latency = metrics.histogram("wall_display_latency_seconds",
+                                      "time from a frame's arrival to its intercept being drawn")
+m_collapsed = metrics.histogram("wall_updates_per_frame", "display updates collapsed into one redraw",
+                                buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+
+
+class StartupProfiler:
+    """ Times each phase of startup, from launch to the first frame
+    on screen, and optionally holds it to a time budget."""
+
+    def __init__(self, t0, enabled, budget=None):
+        self.enabled = enabled
+        self.budget = budget
+        self.t0 = t0
+        self.last = t0
+        self.phases = []
+        self.shutdown = None        # set once there's something to shut down
+        self.exit_status = None     # set when the budget check is done
+
+    def phase(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def first_frame(self):
+        self.phase("first frame")
+        if not self.enabled:
+            return
+        total = self.last - self.t0
+        print("Startup profile:", flush=True)
+        for name, elapsed in self.phases:
+            print("  %-14s %7.3fs" % (name, elapsed))
+        print("  %-14s %7.3fs" % ("total", total), flush=True)
+        if self.budget is not None:
+            if total > self.budget:
+                print("Startup took %.3fs, over budget of %.3fs" % (total, self.budget), flush=True)
+                self.exit_status = 1
+            else:
+                self.exit_status = 0
+            self.shutdown()
+
 
 class BTAdapter (threading.Thread):
-    def __init__(self, master, btQueue):
-        threading.Thread.__init__(self)
+    def __init__(self, master, btQueue, sock=None, hci=None, adaptive_scan=True, bus=None):
+        threading.Thread.__init__(self, name="capture")
         self.btQueue = btQueue
+        self.bus = bus      # wall_bus.BusWriter for the raw frames
 
         self.stop_event = threading.Event()
+        self.kernel_timestamps = kernel_timestamps
+        self.scan = None
+
+        if sock is not None:
+            # Frames from somewhere other than the adapter, such as the
+            # synthetic load generator. Nothing to set up.
+            self.sock = sock
+            self.hci = None
+            return
 
-        btlib = find_library("bluetooth")
-        if not btlib:
-            raise Exception(
-                "Can't find required bluetooth libraries"
-                " (need to install bluez)"
-            )
-        self.bluez = CDLL(btlib, use_errno=True)
+        self.hci = hci or hci_control.BluezHCI()
 
-        dev_id = self.bluez.hci_get_route(None)
+        dev_id = self.hci.get_route()
         
         self.sock = socket(AF_BLUETOOTH, SOCK_RAW, BTPROTO_HCI)
         if not self.sock:
@@ -84,7 +168,7 @@ class BTAdapter (threading.Thread):
 
         self.sock.bind((dev_id,))
 
-        err = self.bluez.hci_le_set_scan_parameters(self.sock.fileno(), 0, 0x10, 0x10, 0, 0, 1000)
+        err = self.hci.set_scan_parameters(self.sock.fileno(), 0x10, 0x10)
         if err < 0:
             raise Exception("Set scan parameters failed")
             # occurs when scanning is still enabled from previous call
@@ -98,18 +182,21 @@ class BTAdapter (threading.Thread):
         )
         self.sock.setsockopt(SOL_HCI, HCI_FILTER, hci_filter)
 
-        err = self.bluez.hci_le_set_scan_enable(
+        if self.kernel_timestamps:
+            self.sock.setsockopt(SOL_HCI, HCI_TIME_STAMP, 1)
+
+        err = self.hci.set_scan_enable(
             self.sock.fileno(),
             1,    # 1 - turn on;  0 - turn off
             0,    # 0-filtering disabled, 1-filter out duplicates
-            1000  # timeout
         )
         if err < 0:
-            errnum = get_errno()
-            raise Exception("{} {}".format(
-                errno.errorcode[errnum],
-                os.strerror(errnum)
-            ))
+            raise Exception(hci_control.errno_text())
+
+        if adaptive_scan:
+            self.scan = ScanController(self.hci, dev_id, frames=lambda: m_frames.value,
+                                       depth=lambda: len(btQueue), capacity=btQueue.maxlen)
+            self.scan.start()
 
     def stop(self):
         self.stop_event.set()
@@ -122,72 +209,132 @@ class BTAdapter (threading.Thread):
             print("Double clean_up", flush=True)
             return
 
-        err = self.bluez.hci_le_set_scan_enable(
+        if self.scan is not None:
+            self.scan.stop()
+            self.scan = None
+
+        if self.hci is None:
+            self.sock.close()
+            self.sock = None
+            return
+
+        err = self.hci.set_scan_enable(
             self.sock.fileno(),
             0,    # 1 - turn on;  0 - turn off
             0,    # 0-filtering disabled, 1-filter out duplicates
-            1000  # timeout
             )
         if err < 0:
-            errnum = get_errno()
-            print("{} {}".format(
-                errno.errorcode[errnum],
-                os.strerror(errnum)
-                ))
+            print(hci_control.errno_text())
 
         self.sock.close()
         self.sock = None
 
+    def receive(self):
+        """ Return (wall clock time, data, monotonic time) for the next frame.
+
+        The times are when the kernel received the frame, if it's
+        timestamping them, otherwise when we got it. The monotonic time is
+        what ages should be worked out from, since the wall clock can be
+        stepped (by the RTC or NTP) while we're running."""
+
+        if not self.kernel_timestamps:
+            data = self.sock.recv(1024)
+            return (time.time(), data, time.monotonic())
+
+        data, ancdata, flags, address = self.sock.recvmsg(1024, CMSG_SPACE(16))
+        now = time.time()
+        mono = time.monotonic()
+        for level, kind, cdata in ancdata:
+            if level == SOL_HCI and kind == HCI_CMSG_TSTAMP:
+                # struct timeval; 8 or 16 bytes depending on the platform
+                sec, usec = struct.unpack("@qq" if len(cdata) >= 16 else "@ll", cdata[:16])
+                arrived = sec + usec / 1000000
+                mono -= max(0.0, now - arrived)
+                return (arrived, data, mono)
+        return (now, data, mono)
+
     def run(self):
         while True:
-            data = self.sock.recv(1024)
-            badge_time = time.time()
-            self.btQueue.appendleft((badge_time, data))
+            try:
+                cept = self.receive()
+            except OSError:
+                if self.stopped():
+                    break   # socket closed under us by clean_up
+                raise
+            if self.bus is not None:
+                ts, data, mono = cept
+                self.bus.publish(wall_bus.encode_raw(ts, mono, data))
+            if len(self.btQueue) == self.btQueue.maxlen:
+                m_queue_drops.inc()
+            self.btQueue.appendleft(cept)
+            m_frames.inc()
             if self.stopped():
                 self.clean_up()
                 break
 
 
-class Logger:
-    def __init__(self):
-        self.intercepts = []
-        self.count = 0
+class RenderScheduler:
+    """ Displays mark themselves dirty here instead of redrawing on every
+    update. Dirty displays are redrawn together at most fps times a second,
+    so redraw cost stays the same however fast intercepts arrive. Like
+    the displays, it's only to be used from the Tk thread."""
 
-    def _writeout(self):
-        filename = time.strftime("%Y%m%d%H%M%S", time.gmtime(time.time())) + ".log"
-        with open(filename, "w+") as f:
-            for ts, data in self.intercepts:
-                hex = ''.join('{0:02x}'.format(x) for x in data)
-                print("%f %s" % (ts, hex), file=f)
-
-    def intercept(self, cept):
-        self.intercepts.append(cept)
-        self.count += 1
-        if self.count >= 1000:
-            self._writeout()
-            self.intercepts = []
-            self.count = 0
-
-    def closeout(self):
-        self._writeout()
+    def __init__(self, master, fps=render_fps):
+        self.master = master
+        self.interval = int(1000 / fps)
+        self.dirty = {}     # display -> updates since its last redraw
+        self.oldest = None  # earliest arrival among them
+        self.pending = False
+
+    def mark(self, display, arrived=None):
+        """ arrived is the monotonic arrival time of the intercept behind
+        this update, if there is one, for measuring display latency."""
+        self.dirty[display] = self.dirty.get(display, 0) + 1
+        if arrived is not None and (self.oldest is None or arrived < self.oldest):
+            self.oldest = arrived
+        if not self.pending:
+            self.pending = True
+            self.master.after(self.interval, self.flush)
+
+    def flush(self):
+        self.pending = False
+        dirty, self.dirty = self.dirty, {}
+        oldest, self.oldest = self.oldest, None
+        for display, updates in dirty.items():
+            display.render(updates)
+            m_collapsed.observe(updates)
+        m_frames_rendered.inc()
+        if oldest is not None:
+            m_display_latency.observe(time.monotonic() - oldest)
 
 
 class LiveDisplay:
-    def __init__(self, master):
+    def __init__(self, master, scheduler):
+        self.scheduler = scheduler
         self.live_canvas = Canvas(master, width=370, height=505, bg=tablebg, borderwidth=0, highlightthickness=0)
         self.live_text = self.live_canvas.create_text(tmargin, tmargin, anchor=NW, text="", font=("Droid Sans Mono", 32))
+        # how many intercepts went into the last redraw
+        self.collapsed_text = self.live_canvas.create_text(370-tmargin, 505-tmargin, anchor=SE, text="",
+                                                           fill="#888888", font=("Droid Sans Mono", 12))
         self.live_canvas.place(x=screenw-margin, y=screenh-margin, anchor=SE)
         self.lines = deque()
 
     def intercept(self, badge):
         line = "%s %s" % (badge[BADGE_ID], badge[BADGE_NAME])
-        self.logtext(line)
+        self.logtext(line, badge[BADGE_MONO])
 
-    def logtext(self, text):
+    def logtext(self, text, arrived=None):
         if len(self.lines) >= 10:
             self.lines.popleft()
         self.lines.append(text)
+        self.scheduler.mark(self, arrived)
+
+    def render(self, updates):
         self.live_canvas.itemconfigure(self.live_text, text="\n".join(self.lines))
+        if updates > 1:
+            self.live_canvas.itemconfigure(self.collapsed_text, text="x%d" % updates)
+        else:
+            self.live_canvas.itemconfigure(self.collapsed_text, text="")
 
 
 class SmoothScroller:
@@ -198,9 +345,15 @@ class SmoothScroller:
         self.canvas = Canvas(master, width=width, height=height, bg=tablebg, borderwidth=0, highlightthickness=0)
         self.text = self.canvas.create_text(tmargin, tmargin, anchor=NW, text="", font=("Droid Sans Mono", MAIN_DISPLAY_FONTSIZE))
         self.canvas.place(x=x, y=y, anchor=NW)
+        self.m_lateness = metrics.histogram("wall_scroll_lateness_seconds",
+                                            "how late scroll ticks run compared to their schedule",
+                                            {"display": type(self).__name__})
         self.scroll()
 
-    def scroll(self):
+    def scroll(self, due=None):
+        now = time.monotonic()
+        if due is not None:
+            self.m_lateness.observe(max(0.0, now - due))
         left, top, right, bottom = self.canvas.bbox(ALL)
         if bottom > self.height:
             self.canvas.move(self.text, 0, -wait_factor)
@@ -209,108 +362,141 @@ class SmoothScroller:
                 self.canvas.move(self.text, 0, -wait_factor)
             else:
                 self.canvas.move(self.text, 0, -top + self.height)
-        self.master.after(self.wait, self.scroll)
+        self.master.after(self.wait, self.scroll, now + self.wait/1000)
 
 
 class NamesDisplay (SmoothScroller):
+    """ The most common names, then the names trending now, rather than
+    every name ever heard. """
+
     def __init__(self, master):
         SmoothScroller.__init__(self, master, width=265, height=680, x=margin+1080+margin, y=350, wait=20)
+        self.master = master
+        self.names = NameTracker()
         self.lines = deque()
         self.scroll()
+        self.updater()
 
     def intercept(self, badge):
-        if badge[BADGE_NAME] not in self.lines:
-            # print("BADGE NAME .%s." % badge[BADGE_NAME])
-            # line = badge[BADGE_NAME] + " "*(8-len(badge[BADGE_NAME]))
-            # print("LINE .%s." % line)
-            self.lines.append(badge[BADGE_NAME])
-            self.canvas.itemconfigure(self.text, text="\n".join(self.lines))
+        self.names.observe(badge[BADGE_ADDR], badge[BADGE_NAME], badge[BADGE_MONO])
+
+    def updater(self):
+        common = [name for name, score in self.names.common(names_common)]
+        trending = [name for name, score in self.names.trending(names_trending)]
+        self.lines = common
+        if trending:
+            self.lines = self.lines + ["", "Trending:"] + trending
+        self.canvas.itemconfigure(self.text, text="\n".join(self.lines))
+        self.master.after(names_update_interval, self.updater)
+
+
+def load_history(filename):
+    """ The score history saved by the last run, to carry on from, or an
+    empty one if there isn't one that can be read. """
+    try:
+        return ScoreHistory.load(filename)
+    except FileNotFoundError:
+        return ScoreHistory()
+    except (OSError, ValueError, struct.error) as e:
+        # Keep the unreadable file rather than overwriting it at the next export
+        print("Can't load score history %s (%s), starting a new one" % (filename, e), flush=True)
+        try:
+            os.replace(filename, filename + ".bad")
+        except OSError:
+            pass
+        return ScoreHistory()
 
 
 class BadgeDisplay (SmoothScroller):
     def __init__(self, master):
         self.master = master
-        self.badges = {}
+        self.index = BadgeIndex()
+        self.badges = BadgeStore(on_evict=self.forget)
+        self.history = load_history(score_history_file)
+        self.auditor = None     # wall_audit.ScoreAuditor, with --audit
+        self.feed = None        # wall_feed.BoardFeed
+        metrics.gauge("wall_score_history_bytes", "memory used by score history samples",
+                      func=self.history.nbytes)
         SmoothScroller.__init__(self, master, width=1080, height=750, x=margin, y=275, wait=30)
         self.lines = deque()
+        self.master.after(score_export_interval, self.export_history)
+        self.m_render = metrics.histogram("wall_render_seconds", "time to rebuild a display's text",
+                                          {"display": "BadgeDisplay"})
         self.scroll()
         self.updater()
+        self.publish_feed()
+
+    def export_history(self):
+        self.history.export(score_history_file)
+        self.master.after(score_export_interval, self.export_history)
 
     def updater(self):
+        self.badges.evict()
+        if self.auditor is not None:
+            self.offer_audits()
         self.update_display()
         self.master.after(5000, self.updater)
 
-    def format_time_ago(self, t, timenow):
-        age = timenow - t
-        if age < 5.0:
-            return " just now"
-        else:
-            hours = int(age / (60*60))
-            age -= hours * 60*60
-            minutes = int(age / 60)
-            age -= minutes * 60
-            secs = int(age/5) * 5
-            if hours > 0:
-                return "%3d:%02d:%02d" % (hours, minutes, secs)
+    def offer_audits(self):
+        """ Give the auditor the badges that have a score to check, and
+        report what it has found since last time. """
+        self.auditor.offer((b[BADGE_ADDR], b[BADGE_ID], b[BADGE_CSCORE]) for b in self.badges.values()
+                           if b[BADGE_TYPE] == BADGE_TYPE_JOCO or b[BADGE_TYPE] == BADGE_TYPE_TRANSIO_TMP)
+        while self.auditor.finished:
+            addr, v = self.auditor.finished.popleft()
+            if v.score is not None:
+                print("Audit %s: %s, claimed %d, GATT score %d" % (addr, v.verdict, v.claimed, v.score),
+                      flush=True)
             else:
-                return "    %2d:%02d" % (minutes, secs)
+                print("Audit %s: %s" % (addr, v.verdict), flush=True)
+
+    def flag(self, b):
+        """ The character shown before a badge's ID on the board. """
+        disputed = self.auditor is not None and self.auditor.disputed(b[BADGE_ADDR])
+        return board_flag(b, disputed, self.index.is_cloned(b[BADGE_TYPE], b[BADGE_ID]))
+
+    def publish_feed(self):
+        if self.feed is not None:
+            rows = {}
+            for b in self.badges.values():
+                rows[b[BADGE_ADDR]] = {
+                    "id": b[BADGE_ID],
+                    "name": b[BADGE_NAME],
+                    "score": b[BADGE_CSCORE],
+                    "flag": self.flag(b),
+                    "seen": int(b[BADGE_TIME] / wall_feed.seen_resolution) * wall_feed.seen_resolution,
+                }
+            self.feed.publish(rows)
+        self.master.after(wall_feed.feed_interval, self.publish_feed)
 
     def update_display(self):
-        timenow = time.time()
+        start = time.perf_counter()
+        timenow = time.monotonic()
         self.lines = []
         for b in sorted(self.badges.values(), key=lambda badge: badge[BADGE_CSCORE], reverse=True):
-            if BADGE_ID_FAKED in b:
-                flag = "*"
-            else:
-                flag = " "
-            ident = b[BADGE_ID]
-            name = b[BADGE_NAME]
-            typ = b[BADGE_TYPE]
-            if typ == BADGE_TYPE_JOCO or typ == BADGE_TYPE_TRANSIO_TMP or typ == BADGE_TYPE_TRANSIO:
-                if b[BADGE_CSCORE] >= 1000:
-                    score = "%2d,%03d" % (b[BADGE_CSCORE]/1000, b[BADGE_CSCORE] % 1000)
-                else:
-                    score = " %5d" % b[BADGE_CSCORE]
-                if b[BADGE_CTRINKET] != 0:   # claims to be eligible for a trinket
-                    flag = "!"
-            else:
-                score = "   N/A"
-            t = self.format_time_ago(b[BADGE_TIME], timenow)
-            line = flag + " " + ident + " " + name + " "*(8-len(name)) + " " + score + " " + t
-            self.lines.append(line)
+            self.lines.append(board_line(b, self.flag(b), timenow))
         self.canvas.itemconfigure(self.text, text="\n".join(self.lines))
+        self.m_render.observe(time.perf_counter() - start)
 
     def intercept(self, badge):
-        if badge[BADGE_ADDR] not in self.badges:
-            badge[BADGE_IDS] = [badge[BADGE_ID]]
-            badge[BADGE_NAMES] = [badge[BADGE_NAME]]
-            badge[BADGE_YEARS] = [badge[BADGE_YEAR]]
-            badge[BADGE_CNT] = 1
-            self.badges[badge[BADGE_ADDR]] = badge
-            # do not call self.update_display()
+        typ = badge[BADGE_TYPE]
+        if self.index.add(badge[BADGE_ADDR], typ, badge[BADGE_ID], badge[BADGE_NAME]):
+            print("Badge ID %s cloned: %s" % (badge[BADGE_ID],
+                  " ".join(sorted(self.index.addresses_for_id(typ, badge[BADGE_ID])))), flush=True)
+        self.history.record(badge[BADGE_ADDR], badge[BADGE_TIME],
+                            badge[BADGE_CSCORE], badge[BADGE_CTRINKET])
+        merge_intercept(self.badges, badge)
+        # do not call self.update_display()
 
-        else:
-            b = self.badges[badge[BADGE_ADDR]]
-            b[BADGE_CNT] += 1
-            b[BADGE_NAME] = badge[BADGE_NAME]
-            b[BADGE_ID] = badge[BADGE_ID]
-            b[BADGE_TIME] = badge[BADGE_TIME]
-            b[BADGE_YEAR] = badge[BADGE_YEAR]
-            if badge[BADGE_NAME] not in b[BADGE_NAMES]:
-                b[BADGE_NAMES].append(badge[BADGE_NAME])
-            if badge[BADGE_ID] not in b[BADGE_IDS]:
-                b[BADGE_IDS].append(badge[BADGE_ID])
-            if badge[BADGE_YEAR] not in b[BADGE_YEARS]:
-                b[BADGE_YEARS].append(badge[BADGE_YEAR])
-            if len(b[BADGE_IDS]) > 1:
-                b[BADGE_ID_FAKED] = True
-            b[BADGE_CTRINKET] = badge[BADGE_CTRINKET]
-            b[BADGE_CSCORE] = badge[BADGE_CSCORE]
-            # do not call self.update_display()
+    def forget(self, b):
+        """ A badge has gone to the cold store. If it comes back, its
+        intercepts will index it again. """
+        self.index.remove(b[BADGE_ADDR], b[BADGE_TYPE], b[BADGE_IDS], b[BADGE_NAMES])
 
 
 class TermDisplay:
-    def __init__(self, master):
+    def __init__(self, master, scheduler):
+        self.scheduler = scheduler
         self.term_canvas = Canvas(master, width=1200, height=750, bg=termbg, borderwidth=0, highlightthickness=0)
         self.term_text = self.term_canvas.create_text(widemargin, widemargin, anchor=NW, text="", font=("Droid Sans Mono", 48))
         self.lines = deque()
@@ -330,47 +516,62 @@ class TermDisplay:
         if len(self.lines) >= 14:
             self.lines.popleft()
         self.lines.append(text)
+        self.scheduler.mark(self)
+
+    def render(self, updates):
         self.term_canvas.itemconfigure(self.term_text, text="\n".join(self.lines))
 
     def clear(self):
         self.lines.clear()
-
-class BadgeDevice(gatt.Device):
-    def connect_succeeded(self):
-        super().connect_succeeded()
-        live_display.logtext("Connected")
-
-    def connect_failed(self, error):
-        super().connect_failed(error)
-        live_display.logtext("Failed")
-
-    def disconnect_succeeded(self):
-        super().disconnect_succeeded()
-        live_display.logtext("Disconnected")
-
-    def services_resolved(self):
-        super().services_resolved()
-        score_service = next(
-            s for s in self.services
-            if s.uuid == '0000bd7e-0000-1000-8000-00805f9b34fb')
-        encrypted_score = next(
-            c for c in score_service.characteristics
-            if c.uuid == '00002e15-0000-1000-8000-00805f9b34fb')
-        encrypted_score.read_value()
-        live_display.logtext("Reading")
-
-    def characteristic_value_update(self, characteristic, value):
-        result = joco_crypto.eval_score_characteristic(value)
-        if result is None:
-            live_display.logtext("Invalid")
-        else:
-            live_display.logtext("%s %d %d" % result)
-        device.disconnect()
-        manager.stop()
-
-    def characteristic_read_value_failed(self, characteristic, error):
-        live_display.logtext("Read failed.")
-
+        self.scheduler.mark(self)
+
+def load_photo(filename, bg):
+    """ Return a PhotoImage of filename flattened onto bg.
+
+    Decoding the 16-bit RGBA PNG through PIL is one of the slowest parts
+    of startup on the Pi Zero, so the flattened image is cached next to it
+    as a PPM, which Tk reads natively. PIL is only loaded when the cache
+    is missing or older than the PNG."""
+
+    cache = os.path.splitext(filename)[0] + ".ppm"
+    try:
+        if os.path.getmtime(cache) >= os.path.getmtime(filename):
+            return PhotoImage(file=cache)
+    except (OSError, TclError):
+        pass
+
+    from PIL import Image, ImageTk
+    image = Image.open(filename).convert("RGBA")
+    flat = Image.new("RGB", image.size, bg)
+    flat.paste(image, mask=image)
+    try:
+        flat.save(cache + ".tmp", format="PPM")
+        os.replace(cache + ".tmp", cache)
+    except OSError:
+        print("Can't write image cache %s" % cache, flush=True)
+    return ImageTk.PhotoImage(flat)
+
+
+parser = argparse.ArgumentParser(description='Wall of Trans-Ionospheric')
+parser.add_argument('--profile-startup', default=False, action='store_const', const=True,
+                    help='report time taken by each phase of startup')
+parser.add_argument('--startup-budget', type=float, default=None,
+                    help='profile startup, then exit after the first frame, '
+                         'with status 1 if startup took longer than this many seconds')
+parser.add_argument('--presence-panel', default=False, action='store_const', const=True,
+                    help='show how many badges are present and how long they stay')
+parser.add_argument('--synthetic', type=int, default=None, metavar='N',
+                    help='no Bluetooth: show N synthetic badges from the load generator')
+parser.add_argument('--synthetic-rate', type=float, default=200.0, metavar='R',
+                    help='with --synthetic, advertisements per second')
+parser.add_argument('--fixed-scan', default=False, action='store_const', const=True,
+                    help="always scan flat out, without adapting to how busy it is")
+parser.add_argument('--audit', default=None, metavar='ADAPTER',
+                    help='check claimed scores over GATT in the background, using this adapter (e.g. hci1)')
+args = parser.parse_args()
+profiler = StartupProfiler(startup_t0, args.profile_startup or args.startup_budget is not None,
+                           args.startup_budget)
+profiler.phase("imports")
 
 margin = 50
 tmargin = 5
@@ -386,6 +587,7 @@ root.overrideredirect(True)
 root.overrideredirect(False)
 root.attributes("-fullscreen", True)
 root.configure(background=bgcolor)
+profiler.phase("tk")
 
 heading = Label(root, text="Trans-Ionospheric", bg=bgcolor, font=("Droid Sans Mono", 100))
 heading.place(x=margin, y=margin-40, anchor=NW)
@@ -399,23 +601,98 @@ names_label.place(x=margin+1085+margin, y=265, anchor=NW)
 live_label = Label(root, text="Intercepts", bg=bgcolor, font=("Droid Sans Mono", 44))
 live_label.place(x=margin+912+margin+435+margin, y=460, anchor=NW)
 
-img = ImageTk.PhotoImage(Image.open("walloftio.png").convert("RGBA"))
+profiler.phase("labels")
+
+img = load_photo(photo_file, bgcolor)
+profiler.phase("image")
 photo_panel = Label(root, image=img, borderwidth=0, bg=bgcolor)
 photo_panel.place(x=screenw-margin/2, y=margin/2, anchor=NE)
 
 badge_display = BadgeDisplay(root)
+badge_display.feed = wall_feed.BoardFeed()
+badge_display.feed.start()
+if args.audit is not None:
+    import gatt, wall_gatt, wall_audit
+    badge_display.auditor = wall_audit.ScoreAuditor(gatt.DeviceManager(adapter_name=args.audit))
+    wall_gatt.start_auditor(badge_display.auditor)
 names_display = NamesDisplay(root)
-live_display = LiveDisplay(root)
-term_display = TermDisplay(root)
+render_scheduler = RenderScheduler(root)
+live_display = LiveDisplay(root, render_scheduler)
+term_display = TermDisplay(root, render_scheduler)
 log = Logger()
+profiler.phase("displays")
+
+
+class MetricsOverlay:
+    """ A few headline numbers from the metrics registry, shown over the
+    photo. Toggled with the middle mouse button."""
+
+    def __init__(self, master):
+        self.master = master
+        self.label = Label(master, text="", justify=LEFT, anchor=NW, bg=tablebg,
+                           font=("Droid Sans Mono", 14))
+        self.label.bind("<Button-2>", self.toggle)
+        self.showing = False
+        self.last_frames = m_frames.value
+        self.last_time = time.monotonic()
+        self.update()
+
+    def toggle(self, event=None):
+        if self.showing:
+            self.label.place_forget()
+        else:
+            self.label.place(x=screenw-margin, y=margin, anchor=NE)
+            self.label.lift()
+        self.showing = not self.showing
+
+    def update(self):
+        now = time.monotonic()
+        frames = m_frames.value
+        rate = (frames - self.last_frames) / (now - self.last_time)
+        self.last_frames = frames
+        self.last_time = now
+        if self.showing:
+            lines = ["adverts/s   %8.1f" % rate,
+                     "queue       %8d" % len(btQueue),
+                     "drops       %8d" % m_queue_drops.value,
+                     "intercepts  %8d" % m_intercepts.value,
+                     "parse fails %8d" % sum(c.value for c in parse_failures.values()),
+                     "cache hits  %7.1f%%" % (parse_cache.hit_rate() * 100),
+                     "process     %6.2fms" % (m_process_time.mean() * 1000),
+                     "latency     %6.1fms" % (m_display_latency.mean() * 1000),
+                     "scroll late %6.0fms" % (max(badge_display.m_lateness.max,
+                                                  names_display.m_lateness.max) * 1000)]
+            self.label.configure(text="\n".join(lines))
+        self.master.after(1000, self.update)
+
+
+class PresencePanel:
+    """ Headline numbers from the presence tracker, above the Names list. """
+
+    def __init__(self, master, tracker):
+        self.master = master
+        self.tracker = tracker
+        self.label = Label(master, text="", justify=LEFT, bg=bgcolor, font=("Droid Sans Mono", 16))
+        self.label.place(x=margin+1085+margin, y=175, anchor=NW)
+        self.update()
+
+    def update(self):
+        mean = int(self.tracker.mean_visit())
+        lines = ["Here now  %5d" % self.tracker.present(),
+                 "Adverts/s %5.1f" % self.tracker.advert_rate(),
+                 "Avg visit %2d:%02d" % (mean / 60, mean % 60)]
+        self.label.configure(text="\n".join(lines))
+        self.master.after(5000, self.update)
 
 
 def click_callback(event):
+    import random
     live_display.logtext("Click!")
     term_display.show()
     term_display.logtext("random %d" % random.randint(1,10000))
+    #import gatt, wall_gatt
     #manager = gatt.DeviceManager(adapter_name='hci1') # separate adapter
-    #device = BadgeDevice(mac_address='e2:15:e5:53:f2:0c', manager=manager)
+    #device = wall_gatt.BadgeDevice(mac_address='e2:15:e5:53:f2:0c', manager=manager, logtext=live_display.logtext)
     #device.connect()
     #manager.run()
     live_display.logtext("Done.")
@@ -427,94 +704,40 @@ def rclick_callback(event):
 
 photo_panel.bind("<Button-1>", click_callback)
 photo_panel.bind("<Button-3>", rclick_callback)
-                  
-def badgeParse(data):
-    """ If the advertisement data contains a valid badge beacon,
-    return the parsed badge data structure. If not, return None."""
-
-    badge_address = ':'.join('{0:02x}'.format(x) for x in data[12:6:-1])
-
-    index = 14
-    badge = False
-    badge_name = None
-    dc26 = False
-    while (index < len(data)-1):
-        packet_len = data[index]
-        packet_type = data[index+1]
-        packet_payload = data[index+2:index+2+packet_len-1]
-        index += packet_len+1
-        if packet_type == 0x01:     # Flags
-            if int(packet_payload[0]) != 0x06:
-                badge = False
-        elif packet_type == 0x09:   # Local Name
-            badge_name = packet_payload.decode("utf-8")
-            badge_name = badge_name[0:8]
-        elif packet_type == 0x19:   # Appearance
-            badge_year = "%02X%d" % (packet_payload[0], packet_payload[1])
-            if packet_payload[1] == 0x26:
-                dc26 = True
-            elif packet_payload[1] == 0x19:
-                dc26 = False
-            else:
-                badge_year = None
-        elif packet_type == 0xFF:   # Manufacturer Specific Data
-            badge_type = (packet_payload[1] << 8) + packet_payload[0]
-            if badge_type == BADGE_TYPE_JOCO or badge_type == BADGE_TYPE_TRANSIO_TMP:
-                badge_id = "%02X%02X" % (packet_payload[3], packet_payload[2])
-                badge_claimed_score = (packet_payload[4] << 8) + packet_payload[5]
-                badge_claimed_trinket = badge_claimed_score & 0x8000
-                badge_claimed_score = badge_claimed_score & 0x7FFF
-                badge = True
-            elif badge_type == BADGE_TYPE_TRANSIO:
-                badge_id = "%02X%02X" % (packet_payload[4], packet_payload[3])
-                badge_claimed_trinket = 0
-                badge_claimed_score = (packet_payload[6] << 8) + packet_payload[7]
-                badge = True
-            elif badge_type == BADGE_TYPE_ANDNXOR:
-                if dc26:
-                    badge_id_offset = 3
-                else:
-                    badge_id_offset = 2
-                badge_id = "%02X%02X" % (packet_payload[badge_id_offset+1], packet_payload[badge_id_offset])
-                badge_claimed_trinket = 0
-                badge_claimed_score = -1   # so it always sorts below JoCo badges
-                badge = True
-            else:
-                badge_id = "????"
-                badge_claimed_trinket = 0
-                badge_claimed_score = -2
-                badge_year = "DCxx"
-                badge = True
-
-    if badge and badge_name is not None and badge_year is not None:
-        return {BADGE_ADDR:   badge_address,
-                BADGE_ID:     badge_id,
-                BADGE_NAME:   badge_name,
-                BADGE_YEAR:   badge_year,
-                BADGE_CTRINKET:   badge_claimed_trinket,
-                BADGE_CSCORE: badge_claimed_score,
-                BADGE_TYPE:   badge_type}
-    else:
-        return None
 
 
 def processAdvertisement(cept):
-    timestamp, data = cept
-    badge = badgeParse(data)
-    if badge is not None:
+    start = time.perf_counter()
+    timestamp, data, mono = cept
+    badges = parse_cache.parse(data)
+    m_parse_time.observe(time.perf_counter() - start)
+    for badge in badges:
         badge[BADGE_TIME] = timestamp
+        badge[BADGE_MONO] = mono
+        presence_tracker.observe(badge[BADGE_ADDR], mono)
         live_display.intercept(badge)
         names_display.intercept(badge)
         badge_display.intercept(badge)
+        if parsed_bus is not None:
+            parsed_bus.publish(wall_bus.encode_badge(badge))
+        m_intercepts.inc()
+    if badges:
         log.intercept(cept)
+    m_process_time.observe(time.perf_counter() - start)
 
 
-def signal_handler(signal, frame):
+def shutdown():
     bt.stop()
     log.closeout()
+    badge_display.badges.close()
+    badge_display.history.export(score_history_file)
     root.quit()
 
 
+def signal_handler(signal, frame):
+    shutdown()
+
+
 def btPoller():
     while True:
         try:
@@ -524,21 +747,56 @@ def btPoller():
         except IndexError:
             break
 
+    termPoller()
+    presence_tracker.advance(time.monotonic())  # here, so the metrics server never has to
+    heartbeat()
     root.after(100, btPoller)
 
 
+last_heartbeat = None
+
+
+def heartbeat():
+    """ Tell the supervisor we're alive. Sent from btPoller, so it stops
+    if intercepts stop being processed, not just if capture stops. """
+    global last_heartbeat
+    now = time.monotonic()
+    if last_heartbeat is not None and now - last_heartbeat < heartbeat_interval / 1000:
+        return
+    last_heartbeat = now
+    if bt.is_alive():
+        try:
+            hbsocket.sendto(b"wall", heartbeat_addr)
+        except OSError:
+            pass    # supervisor not running
+
+
+# Terminal output waiting to go on the screen. Only the Tk thread may touch
+# the display, so terminal_thread leaves (method, args) here for btPoller.
+termQueue = deque()
+
+
 def terminal_thread():
-    global termsocket, term_display
+    global termsocket
     while True:
         (sock, address) = termsocket.accept()       # blocking
-        term_display.show()
+        termQueue.append(("show", ()))
         stuff = sock.recv(512)
         while len(stuff) != 0:
             for line in stuff.decode('ascii').splitlines():
-                term_display.logtext(line)
+                termQueue.append(("logtext", (line,)))
             stuff = sock.recv(512)
-        term_display.hide()
-        term_display.clear()
+        termQueue.append(("hide", ()))
+        termQueue.append(("clear", ()))
+
+
+def termPoller():
+    while True:
+        try:
+            method, args = termQueue.popleft()
+        except IndexError:
+            break
+        getattr(term_display, method)(*args)
 
 
 termsocket = socket(AF_INET, SOCK_STREAM)
@@ -547,9 +805,53 @@ termsocket.listen(5)
 termthread = threading.Thread(target=terminal_thread)
 termthread.start()
 
+presence_tracker = PresenceTracker()
+metrics.gauge("wall_badges_present", "badges heard in the last %d seconds" % presence_tracker.window,
+              func=lambda: presence_tracker.present_count)
+metrics.gauge("wall_visits", "visits that have ended", func=lambda: presence_tracker.visits)
+if args.presence_panel:
+    presence_panel = PresencePanel(root, presence_tracker)
+
+parse_cache = ParseCache()
+metrics.counter("wall_parse_cache_hits_total", "advertisements found in the parse cache", func=lambda: parse_cache.hits)
+metrics.counter("wall_parse_cache_misses_total", "advertisements parsed by badgeParse", func=lambda: parse_cache.misses)
+metrics.counter("wall_parse_cache_evictions_total", "advertisements dropped from the parse cache",
+                func=lambda: parse_cache.evictions)
+metrics.gauge("wall_parse_cache_hit_rate", "fraction of advertisements found in the parse cache", func=parse_cache.hit_rate)
+
 btQueue = deque(maxlen=1000)
-bt = BTAdapter(root, btQueue)
+metrics.gauge("wall_queue_depth", "frames waiting in btQueue", func=lambda: len(btQueue))
+wall_metrics.MetricsServer(metrics).start()
+metrics_overlay = MetricsOverlay(root)
+photo_panel.bind("<Button-2>", metrics_overlay.toggle)
+try:
+    raw_bus = wall_bus.BusWriter("raw")
+    parsed_bus = wall_bus.BusWriter("parsed")
+except OSError as e:
+    print("No intercept bus: %s" % e, flush=True)
+    raw_bus = parsed_bus = None
+if args.synthetic is not None:
+    import wall_loadgen
+    bt = BTAdapter(root, btQueue, bus=raw_bus, sock=wall_loadgen.FakeHCISocket(
+        wall_loadgen.LoadGenerator(badges=args.synthetic, rate=args.synthetic_rate)))
+else:
+    bt = BTAdapter(root, btQueue, bus=raw_bus, adaptive_scan=not args.fixed_scan)
 bt.start()
 signal.signal(signal.SIGINT, signal_handler)
+wall_prof = wall_profiler.WallProfiler()
+signal.signal(signal.SIGUSR1, wall_prof.toggle)
+signal.signal(signal.SIGUSR2, wall_prof.memory_snapshot)
+hbsocket = socket(AF_INET, SOCK_DGRAM)
+profiler.phase("bluetooth")
 btPoller()
+profiler.shutdown = shutdown
+root.after_idle(profiler.first_frame)
 root.mainloop()
+
+if profiler.exit_status is not None:
+    # Done with the startup budget check. Make sure the scan is turned off
+    # so the next run can start one, then don't wait for the other threads.
+    bt.join(shutdown_wait)
+    if bt.is_alive():
+        bt.clean_up()   # no frames arriving to wake it up
+    os._exit(profiler.exit_status)